@@ -0,0 +1,237 @@
+"""
+A module defining typed, buffer-based collective operations.
+
+Numeric data are communicated directly from numpy buffers rather than
+pickled, so the root rank does not hold both pickled and unpickled
+copies of gathered data.
+
+.. date:: 2026-10-16
+"""
+
+import mpi4py.MPI as MPI
+import numpy as np
+import pandas as pd
+import pickle
+
+import _constants
+
+COMM      = MPI.COMM_WORLD
+ROOT_RANK = _constants.ROOT_RANK
+
+# The largest element count and displacement representable by MPI.
+MAX_COUNT = 2**31 - 1
+
+
+def gatherv(array, comm=COMM, root=ROOT_RANK):
+    """
+    Gather the one-dimensional numeric *array* from every rank of *comm*
+    and return the concatenation, in rank order, on *root*. Other ranks
+    receive None.
+
+    All ranks must pass arrays of the same dtype. Gathers of more than
+    MAX_COUNT elements are split into several rounds.
+    """
+
+    array = np.ascontiguousarray(array)
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    counts = np.array(comm.allgather(len(array)), dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    recvbuf = np.empty(counts.sum(), dtype=array.dtype) if rank == root else None
+
+    if counts.sum() <= MAX_COUNT:
+        if rank == root:
+            recvspec = [recvbuf, counts.tolist(), offsets.tolist()]
+        else:
+            recvspec = None
+        comm.Gatherv(array, recvspec, root=root)
+        return (recvbuf)
+
+    chunk = max(MAX_COUNT // size, 1)
+    nrounds = -(-counts.max() // chunk)
+
+    for iround in range(nrounds):
+        start = iround * chunk
+        _counts = np.clip(counts - start, 0, chunk)
+        _offsets = np.concatenate([[0], np.cumsum(_counts)[:-1]])
+        sendbuf = array[start: start+_counts[rank]]
+        if rank == root:
+            _recvbuf = np.empty(_counts.sum(), dtype=array.dtype)
+            recvspec = [_recvbuf, _counts.tolist(), _offsets.tolist()]
+        else:
+            recvspec = None
+        comm.Gatherv(sendbuf, recvspec, root=root)
+        if rank == root:
+            for irank in range(size):
+                i0 = offsets[irank] + start
+                j0 = _offsets[irank]
+                recvbuf[i0: i0+_counts[irank]] = _recvbuf[j0: j0+_counts[irank]]
+
+    return (recvbuf)
+
+
+def gather_dataframe(dataframe, comm=COMM, root=ROOT_RANK):
+    """
+    Gather DataFrames from every rank of *comm* and return their
+    concatenation, in rank order and with a fresh index, on *root*.
+    Other ranks receive None.
+
+    Numeric columns are gathered with gatherv(). Other columns (e.g.,
+    network and station codes) are gathered as integer codes, and only
+    the distinct values on each rank are pickled. *dataframe* may be
+    None or empty on ranks without data.
+    """
+
+    rank = comm.Get_rank()
+
+    if dataframe is None or len(dataframe.columns) == 0:
+        dataframe = None
+        header = None
+    else:
+        header = [(column, dataframe[column].dtype) for column in dataframe.columns]
+
+    # Agree on a common schema.
+    headers = comm.gather(header, root=root)
+    if rank == root:
+        schema = next(filter(lambda item: item is not None, headers), [])
+    else:
+        schema = None
+    schema = comm.bcast(schema, root=root)
+
+    nrows = comm.gather(0 if dataframe is None else len(dataframe), root=root)
+
+    columns = dict()
+    for column, dtype in schema:
+        numeric = isinstance(dtype, np.dtype) and dtype.kind in "biuf"
+        if numeric is True:
+            if dataframe is None:
+                values = np.empty(0, dtype=dtype)
+            else:
+                values = dataframe[column].to_numpy(dtype=dtype)
+            columns[column] = gatherv(values, comm=comm, root=root)
+        else:
+            if dataframe is None:
+                codes, uniques = np.empty(0), np.empty(0, dtype=object)
+            else:
+                codes, uniques = pd.factorize(dataframe[column])
+            codes = codes.astype(_constants.DTYPE_INDEX)
+            codes = gatherv(codes, comm=comm, root=root)
+            uniques = comm.gather(np.asarray(uniques, dtype=object), root=root)
+            if rank == root:
+                # Shift each rank's codes past the distinct values of
+                # preceding ranks. Missing values have code -1 and stay
+                # missing.
+                nuniques = [len(_uniques) for _uniques in uniques]
+                shifts = np.concatenate([[0], np.cumsum(nuniques)[:-1]])
+                shifts = np.repeat(shifts, nrows).astype(codes.dtype)
+                categories = np.concatenate(uniques)
+                mask = codes >= 0
+                values = np.full(len(codes), None, dtype=object)
+                values[mask] = categories[codes[mask] + shifts[mask]]
+                columns[column] = values
+
+    if rank != root:
+        return (None)
+
+    return (pd.DataFrame(columns, columns=[column for column, _ in schema]))
+
+
+def allgatherv(array, comm=COMM):
+    """
+    Gather the one-dimensional numeric *array* from every rank of *comm*
+    and return the concatenation, in rank order, on every rank.
+
+    All ranks must pass arrays of the same dtype, and the concatenation
+    must not exceed MAX_COUNT elements.
+    """
+
+    array = np.ascontiguousarray(array)
+
+    counts = np.array(comm.allgather(len(array)), dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    if counts.sum() > MAX_COUNT:
+        raise (ValueError(f"Cannot gather more than {MAX_COUNT} elements."))
+
+    recvbuf = np.empty(counts.sum(), dtype=array.dtype)
+    comm.Allgatherv(array, [recvbuf, counts.tolist(), offsets.tolist()])
+
+    return (recvbuf)
+
+
+def bcast_array(array, comm=COMM, root=ROOT_RANK):
+    """
+    Broadcast the numeric *array* from *root* to every rank of *comm*
+    and return it. *array* is ignored on other ranks.
+
+    Only the shape and dtype are pickled; data are broadcast with Bcast
+    directly into a preallocated array, in chunks of at most MAX_COUNT
+    elements.
+    """
+
+    if comm.Get_rank() == root:
+        array = np.ascontiguousarray(array)
+        header = (array.shape, array.dtype)
+    else:
+        header = None
+
+    shape, dtype = comm.bcast(header, root=root)
+
+    if comm.Get_rank() != root:
+        array = np.empty(shape, dtype=dtype)
+
+    _bcast_chunked(array.reshape(-1), comm, root)
+
+    return (array)
+
+
+def _bcast_chunked(values, comm, root):
+    """
+    Broadcast the one-dimensional array *values* in place with Bcast,
+    in chunks of at most MAX_COUNT elements.
+    """
+
+    for start in range(0, values.size, MAX_COUNT):
+        comm.Bcast(values[start: start+MAX_COUNT], root=root)
+
+    return (True)
+
+
+def bcast(obj, comm=COMM, root=ROOT_RANK):
+    """
+    Broadcast the picklable *obj* from *root* to every rank of *comm*
+    and return it. *obj* is ignored on other ranks.
+
+    *obj* is pickled with protocol 5 so that large contiguous buffers,
+    such as the numpy arrays underlying DataFrames and ScalarField3D
+    objects, are kept out of band. The remaining pickle is broadcast
+    with bcast(). Buffers are broadcast with Bcast directly into
+    preallocated arrays and are unpickled without further copies.
+    """
+
+    rank = comm.Get_rank()
+
+    if rank == root:
+        buffers = []
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        buffers = [
+            np.frombuffer(buffer.raw(), dtype=np.uint8)
+            for buffer in buffers
+        ]
+        header = (data, [buffer.size for buffer in buffers])
+    else:
+        header = None
+
+    data, sizes = comm.bcast(header, root=root)
+
+    if rank != root:
+        buffers = [np.empty(size, dtype=np.uint8) for size in sizes]
+
+    for buffer in buffers:
+        _bcast_chunked(buffer, comm, root)
+
+    if rank == root:
+        return (obj)
+
+    return (pickle.loads(data, buffers=buffers))
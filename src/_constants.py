@@ -4,6 +4,7 @@ EARTH_RADIUS              = 6371.
 ROOT_RANK                 = 0
 DISPATCH_REQUEST_TAG      = 100
 DISPATCH_TRANSMISSION_TAG = 101
+DTYPE_INDEX               = np.int32
 DTYPE_INT                 = np.int64
 DTYPE_REAL                = np.float64
 
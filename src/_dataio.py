@@ -8,10 +8,99 @@ A module defining basic I/O functions.
 import numpy as np
 import pandas as pd
 import pykonal
+import queue
+import tables
+import threading
 
 import _constants
 import _picklable
 
+# The name of the single HDF5 output store.
+OUTPUT_FILENAME = "vorotomo.h5"
+
+# Columns identifying an arrival.
+ARRIVAL_KEYS = ["network", "station", "phase", "event_id"]
+
+# Grid metadata stored as attributes rather than datasets.
+GRID_KEYS = ("min_coords", "node_intervals", "npts")
+
+class AsyncWriter(object):
+    """
+    A class to run write functions in a background thread.
+
+    At most *maxsize* writes are queued; submit() blocks while the
+    queue is full. The first exception raised by a write is re-raised
+    by the next call to submit() or wait().
+    """
+
+    def __init__(self, maxsize=1):
+        self._error = None
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _raise(self):
+        """
+        Re-raise the first exception raised by a write, if any.
+        """
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise (error)
+
+        return (True)
+
+    def _run(self):
+        """
+        Execute queued writes until a sentinel is received.
+        """
+
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                func, args, kwargs = item
+                if self._error is None:
+                    func(*args, **kwargs)
+            except Exception as exc:
+                self._error = exc
+            finally:
+                self._queue.task_done()
+
+        return (True)
+
+    def close(self):
+        """
+        Wait for queued writes to finish and stop the thread.
+        """
+
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+        return (self._raise())
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) for execution.
+        """
+
+        self._raise()
+        self._queue.put((func, args, kwargs))
+
+        return (True)
+
+    def wait(self):
+        """
+        Block until all queued writes have finished.
+        """
+
+        self._queue.join()
+
+        return (self._raise())
+
+
 def parse_event_data(argc):
     """
     Parse and return event data (origins and phases) specified on the
@@ -84,3 +173,154 @@ def parse_velocity_models(cfg):
         model.values = _model.values
 
     return (pwave_model, swave_model)
+
+
+def _chunkshape(shape, itemsize, nbytes=2**20):
+    """
+    Return a chunk shape of roughly *nbytes* for an array of *shape*
+    whose chunks span whole trailing planes, so that slices along the
+    leading spatial axis (e.g., depth) read few chunks.
+    """
+
+    shape = tuple(int(n) for n in shape)
+    plane = int(np.prod(shape[-2:])) * itemsize
+    nrows = int(np.clip(nbytes // max(plane, 1), 1, shape[-3]))
+
+    return ((1,) * (len(shape) - 3) + (nrows,) + shape[-2:])
+
+
+def _create_array(handle, group, name, values, filters):
+    """
+    Write *values* as a chunked, compressed dataset *name* in *group*.
+    """
+
+    values = np.asarray(values)
+    chunkshape = None
+    if values.ndim >= 3 and values.size > 0:
+        chunkshape = _chunkshape(values.shape, values.dtype.itemsize)
+
+    array = handle.create_carray(
+        group,
+        name,
+        atom=tables.Atom.from_dtype(values.dtype),
+        shape=values.shape,
+        filters=filters,
+        chunkshape=chunkshape
+    )
+    # Copy large stacks (which may be memory mapped) one realization
+    # at a time.
+    if values.ndim == 4:
+        for ireal in range(len(values)):
+            array[ireal] = values[ireal]
+    else:
+        array[...] = values
+
+    return (array)
+
+
+def write_iteration(path, models, arrays, events, arrivals):
+    """
+    Write the outputs of one iteration using *path* as the prefix.
+
+    *models* maps names (e.g., "pwave_model") to velocity models,
+    *arrays* is a dictionary of arrays to write to a NPZ file (or None),
+    and *events* and *arrivals* are written to a HDF5 file using
+    pandas.HDFStore.
+    """
+
+    for name, model in models.items():
+        model.savez(f"{path}.{name}")
+
+    if arrays is not None:
+        np.savez(f"{path}.realizations.npz", **arrays)
+
+    events.to_hdf(f"{path}.events.h5", key="events")
+    arrivals.to_hdf(f"{path}.events.h5", key="arrivals")
+
+    return (True)
+
+
+def write_iteration_hdf5(
+    path,
+    iiter,
+    models,
+    arrays,
+    events,
+    arrivals,
+    complevel=4,
+    stack_offsets=None
+):
+    """
+    Write the outputs of iteration *iiter* to the group "/iterNN" of the
+    single HDF5 store at *path*.
+
+    Models and *arrays* are written as chunked, compressed datasets,
+    with grid metadata stored once per group as attributes. Realization
+    stacks (e.g., "pwave_stack") hold only the realizations not already
+    stored in earlier groups; *stack_offsets* maps their names to the
+    index of their first realization in the full stack, which is stored
+    as the "<name>_offset" attribute. Empty stacks are not written. Arrival
+    metadata are written once, to "/arrivals"; each iteration then
+    stores only the residual column, aligned with those rows, as
+    "/iterNN/residuals". If the arrivals no longer match the stored
+    metadata, the full table is written to "/iterNN/arrivals" instead.
+    *events* are written to "/iterNN/events".
+    """
+
+    group = f"iter{iiter:02d}"
+    filters = tables.Filters(complevel=complevel, complib="zlib", shuffle=True)
+    arrays = dict() if arrays is None else dict(arrays)
+
+    with tables.open_file(path, mode="a") as handle:
+        # Replace any earlier output of this iteration.
+        if f"/{group}" in handle:
+            handle.remove_node(f"/{group}", recursive=True)
+        node = handle.create_group("/", group)
+        for key in GRID_KEYS:
+            if key in arrays:
+                node._v_attrs[key] = np.asarray(arrays.pop(key))
+        if stack_offsets is not None:
+            for name, offset in stack_offsets.items():
+                node._v_attrs[f"{name}_offset"] = int(offset)
+        for name, model in models.items():
+            _create_array(handle, node, name, model.values, filters)
+        for name, values in arrays.items():
+            if name.endswith("_stack") and len(values) == 0:
+                continue
+            _create_array(handle, node, name, values, filters)
+        has_arrivals = "/arrivals" in handle
+
+    kwargs = dict(format="table", complevel=complevel, complib="zlib")
+    events.to_hdf(path, key=f"{group}/events", **kwargs)
+
+    if has_arrivals is False:
+        arrivals.to_hdf(path, key="arrivals", data_columns=ARRIVAL_KEYS, **kwargs)
+        residuals = arrivals["residual"].values
+    else:
+        base = pd.read_hdf(path, key="arrivals", columns=ARRIVAL_KEYS)
+        base = pd.MultiIndex.from_frame(base)
+        current = arrivals.set_index(ARRIVAL_KEYS)["residual"]
+        residuals = None
+        # Residuals may be NaN (e.g., for arrivals outside their
+        # traveltime-lookup table), so match keys rather than values.
+        if (
+            current.index.is_unique
+            and base.is_unique
+            and len(current) == len(base)
+            and base.isin(current.index).all()
+        ):
+            residuals = current.reindex(base).values
+        if residuals is None:
+            arrivals.to_hdf(path, key=f"{group}/arrivals", **kwargs)
+            return (True)
+
+    with tables.open_file(path, mode="a") as handle:
+        _create_array(
+            handle,
+            f"/{group}",
+            "residuals",
+            np.asarray(residuals, dtype=_constants.DTYPE_REAL),
+            filters
+        )
+
+    return (True)
@@ -1,23 +1,31 @@
+import collections
+import concurrent.futures
+import copy
+import functools
 import mpi4py.MPI as MPI
 import numpy as np
 import os
 import pandas as pd
 import pykonal
-import scipy.sparse
-import scipy.spatial
+import scipy.interpolate
 
+import _collective
 import _dataio
 import _constants
+import _linalg
+import _picklable
+import _rays
+import _statistics
+import _traveltime
 import _utilities
+import _voronoi
 
 # Get logger handle.
 logger = _utilities.get_logger(f"__main__.{__name__}")
 
 # Define aliases.
-PointSourceSolver = pykonal.solver.PointSourceSolver
 geo2sph = pykonal.transformations.geo2sph
 sph2geo = pykonal.transformations.sph2geo
-sph2xyz = pykonal.transformations.sph2xyz
 
 COMM       = MPI.COMM_WORLD
 RANK       = COMM.Get_rank()
@@ -34,21 +42,30 @@ class InversionIterator(object):
     def __init__(self, argc):
         self._argc = argc
         self._arrivals = None
+        self._cell_labels = None
         self._cfg = None
+        self._comm = None
+        self._decimation = 1
+        self._dispatch_affinity = None
         self._events = None
+        self._full_grid = None
         self._iiter = 0
-        self._projection_matrix = None
+        self._ray_cache = None
         self._pwave_model = None
         self._swave_model = None
         self._pwave_realization_stack = None
         self._swave_realization_stack = None
-        self._pwave_variance = None
-        self._swave_variance = None
+        self._synchronized_versions = dict()
         self._residuals = None
+        self._saved_realizations = dict()
         self._sensitivity_matrix = None
         self._stations = None
         self._sampled_arrivals = None
+        self._traveltime_store = None
+        self._versions = collections.Counter()
         self._voronoi_cells = None
+        self._voronoi_index = None
+        self._writer = None
 
     @property
     def argc(self):
@@ -61,6 +78,15 @@ class InversionIterator(object):
     @arrivals.setter
     def arrivals(self, value):
         self._arrivals = value
+        self._touch("arrivals")
+
+    @property
+    def cell_labels(self):
+        return (self._cell_labels)
+
+    @cell_labels.setter
+    def cell_labels(self, value):
+        self._cell_labels = value
 
     @property
     def cfg(self):
@@ -69,6 +95,27 @@ class InversionIterator(object):
     @cfg.setter
     def cfg(self, value):
         self._cfg = value
+        self._touch("cfg")
+
+    @property
+    def comm(self):
+        if self._comm is None:
+            return (COMM)
+        return (self._comm)
+
+    @comm.setter
+    def comm(self, value):
+        # Affinities and synchronized versions are only meaningful
+        # within a single communicator.
+        self._comm = value
+        self._dispatch_affinity = None
+        self._synchronized_versions = dict()
+
+    @property
+    def dispatch_affinity(self):
+        if self._dispatch_affinity is None:
+            self._dispatch_affinity = dict()
+        return (self._dispatch_affinity)
 
     @property
     def events(self):
@@ -77,6 +124,7 @@ class InversionIterator(object):
     @events.setter
     def events(self, value):
         self._events = value
+        self._touch("events")
 
     @property
     def iiter(self):
@@ -86,14 +134,6 @@ class InversionIterator(object):
     def iiter(self, value):
         self._iiter = value
 
-    @property
-    def projection_matrix(self):
-        return (self._projection_matrix)
-
-    @projection_matrix.setter
-    def projection_matrix(self, value):
-        self._projection_matrix = value
-
     @property
     def pwave_model(self):
         return (self._pwave_model)
@@ -101,11 +141,15 @@ class InversionIterator(object):
     @pwave_model.setter
     def pwave_model(self, value):
         self._pwave_model = value
+        self._touch("pwave_model")
 
     @property
     def pwave_realization_stack(self):
         if self._pwave_realization_stack is None:
-           self._pwave_realization_stack = []
+            self._pwave_realization_stack = _statistics.RealizationStack(
+                storage=self.cfg["workspace"]["realization_storage"],
+                spill_dir=self.cfg["workspace"]["output_dir"]
+            )
         return (self._pwave_realization_stack)
 
     @pwave_realization_stack.setter
@@ -114,9 +158,19 @@ class InversionIterator(object):
 
     @property
     def pwave_variance(self):
-        stack = np.stack(self.pwave_realization_stack)
-        var = np.var(stack, axis=0)
-        return (var)
+        return (self.pwave_realization_stack.variance)
+
+    @property
+    def ray_cache(self):
+        if self._ray_cache is None:
+            self._ray_cache = _rays.RayCache(
+                max_size=self.cfg["workspace"]["ray_cache_size"] * 2**20
+            )
+        return (self._ray_cache)
+
+    @property
+    def rank(self):
+        return (self.comm.Get_rank())
 
     @property
     def residuals(self):
@@ -133,6 +187,7 @@ class InversionIterator(object):
     @sampled_arrivals.setter
     def sampled_arrivals(self, value):
         self._sampled_arrivals = value
+        self._touch("sampled_arrivals")
 
     @property
     def sensitivity_matrix(self):
@@ -149,6 +204,7 @@ class InversionIterator(object):
     @stations.setter
     def stations(self, value):
         self._stations = value
+        self._touch("stations")
 
     @property
     def swave_model(self):
@@ -157,11 +213,15 @@ class InversionIterator(object):
     @swave_model.setter
     def swave_model(self, value):
         self._swave_model = value
+        self._touch("swave_model")
 
     @property
     def swave_realization_stack(self):
         if self._swave_realization_stack is None:
-           self._swave_realization_stack = []
+            self._swave_realization_stack = _statistics.RealizationStack(
+                storage=self.cfg["workspace"]["realization_storage"],
+                spill_dir=self.cfg["workspace"]["output_dir"]
+            )
         return (self._swave_realization_stack)
 
     @swave_realization_stack.setter
@@ -170,9 +230,27 @@ class InversionIterator(object):
 
     @property
     def swave_variance(self):
-        stack = np.stack(self.swave_realization_stack)
-        var = np.var(stack, axis=0)
-        return (var)
+        return (self.swave_realization_stack.variance)
+
+    @property
+    def traveltime_store(self):
+        if self._traveltime_store is None:
+            self._traveltime_store = _traveltime.TraveltimeStore(
+                self.cfg["workspace"]["traveltime_dir"],
+                fmt=self.cfg["workspace"]["traveltime_store"],
+                precision=self.cfg["workspace"]["traveltime_precision"],
+                compress=self.cfg["workspace"]["compress_traveltimes"],
+                cache_size=self.cfg["workspace"]["traveltime_cache_size"] * 2**20
+            )
+        return (self._traveltime_store)
+
+    @property
+    def writer(self):
+        if self._writer is None:
+            self._writer = _dataio.AsyncWriter(
+                maxsize=self.cfg["workspace"]["save_queue_size"]
+            )
+        return (self._writer)
 
     @property
     def voronoi_cells(self):
@@ -181,18 +259,36 @@ class InversionIterator(object):
     @voronoi_cells.setter
     def voronoi_cells(self, value):
         self._voronoi_cells = value
+        self._voronoi_index = None
+        self._touch("voronoi_cells")
+
+    @property
+    def voronoi_index(self):
+        if self._voronoi_index is None:
+            self._voronoi_index = _voronoi.VoronoiIndex(
+                self.voronoi_cells,
+                workers=self.cfg["parallel"]["nthreads"]
+            )
+        return (self._voronoi_index)
 
 
     @_utilities.log_errors(logger)
-    @_utilities.root_only(RANK)
     def _compute_model_update(self, phase):
         """
         Compute the model update for a single realization and appends
         the results to the realization stack.
 
-        Only the root rank performs this operation.
+        Only the root rank performs this operation unless the solve is
+        distributed, in which case every rank solves the system formed
+        by the rows it holds.
         """
 
+        distributed = self.cfg["parallel"]["distributed_solve"]
+
+        if self.rank != ROOT_RANK and distributed is False:
+            self.comm.barrier()
+            return (True)
+
         logger.info(f"Computing {phase}-wave model update")
 
         if phase == "P":
@@ -207,88 +303,138 @@ class InversionIterator(object):
         btol = self.cfg["algorithm"]["btol"]
         conlim = self.cfg["algorithm"]["conlim"]
         maxiter = self.cfg["algorithm"]["maxiter"]
+        solver = self.cfg["algorithm"]["solver"]
+        precondition = self.cfg["algorithm"]["precondition"]
+        dense_threshold = self.cfg["algorithm"]["dense_threshold"]
 
-        result = scipy.sparse.linalg.lsmr(
-            self.sensitivity_matrix,
-            self.residuals,
-            damp,
-            atol,
-            btol,
-            conlim,
-            maxiter,
-            show=False
-        )
-        x, istop, itn, normr, normar, norma, conda, normx = result
-        delta_slowness = self.projection_matrix * x
-        delta_slowness = delta_slowness.reshape(model.npts)
-        slowness = np.power(model.values, -1) + delta_slowness
-        velocity = np.power(slowness, -1)
+        matrix = self.sensitivity_matrix
 
-        if phase == "P":
-            self.pwave_realization_stack.append(velocity)
+        if distributed is True:
+            comm = self.comm
+            residuals = _collective.allgatherv(self.residuals, comm=comm)
         else:
-            self.swave_realization_stack.append(velocity)
+            comm = None
+            residuals = self.residuals
+            # Small problems are solved faster directly.
+            if np.prod(matrix.shape) <= dense_threshold:
+                solver = "dense"
+
+        x, itn, normr = _linalg.solve(
+            matrix,
+            residuals,
+            solver=solver,
+            damp=damp,
+            atol=atol,
+            btol=btol,
+            conlim=conlim,
+            maxiter=maxiter,
+            precondition=precondition,
+            comm=comm
+        )
+
+        logger.info(
+            f"{phase}-wave {solver} solve: {itn} iterations, "
+            f"damped residual norm {normr:.6g}."
+        )
+
+        if self.rank == ROOT_RANK:
+            delta_slowness = x[self.cell_labels]
+            slowness = np.power(model.values, -1) + delta_slowness
+            velocity = np.power(slowness, -1)
+
+            if phase == "P":
+                self.pwave_realization_stack.append(velocity)
+            else:
+                self.swave_realization_stack.append(velocity)
+
+        self.comm.barrier()
 
         return (True)
 
 
     @_utilities.log_errors(logger)
-    def _compute_sensitivity_matrix(self, phase):
+    def _compute_sensitivity_matrices(self, phase, samples, cells, labels):
         """
-        Compute the sensitivity matrix.
+        Compute one sensitivity matrix per realization from the sampled
+        arrivals, Voronoi cells, and grid-node cell labels of each
+        realization in *samples*, *cells*, and *labels*. Only the root
+        rank needs *samples*; each worker receives the arrivals of the
+        stations dispatched to it.
+
+        Ray points are assigned to cells by KD-tree query or, if
+        "ray_projection" is "labels", by the label of the nearest grid
+        node.
+
+        Each station's traveltime-lookup table is loaded, and each ray
+        traced, once for all realizations. A list of (matrix, residuals)
+        tuples is returned on the root rank, or on every rank if the
+        solve is distributed, and None otherwise.
         """
 
-        logger.info(f"Computing {phase}-wave sensitivity matrix")
+        nreal = len(samples)
+        logger.info(f"Computing {nreal} {phase}-wave sensitivity matrices")
 
         nvoronoi = self.cfg["algorithm"]["nvoronoi"]
-        traveltime_dir = self.cfg["workspace"]["traveltime_dir"]
-
-        index_keys = ["network", "station"]
-        arrivals = self.sampled_arrivals.set_index(index_keys)
-
-        arrivals = arrivals.sort_index()
-
-        if RANK == ROOT_RANK:
-            ids = arrivals.index.unique()
-            self._dispatch(ids)
-
-            logger.debug("Compiling sensitivity matrix.")
-            column_idxs = COMM.gather(None, root=ROOT_RANK)
-            nsegments = COMM.gather(None, root=ROOT_RANK)
-            nonzero_values = COMM.gather(None, root=ROOT_RANK)
-            residuals = COMM.gather(None, root=ROOT_RANK)
-
-            column_idxs = list(filter(lambda x: x is not None, column_idxs))
-            nsegments = list(filter(lambda x: x is not None, nsegments))
-            nonzero_values = list(filter(lambda x: x is not None, nonzero_values))
-            residuals = list(filter(lambda x: x is not None, residuals))
+        nthreads = self.cfg["parallel"]["nthreads"]
+        distributed = self.cfg["parallel"]["distributed_solve"]
+        ray_projection = self.cfg["algorithm"]["ray_projection"]
 
+        self.synchronize(attrs=["events"])
 
-            column_idxs = np.concatenate(column_idxs)
-            nonzero_values = np.concatenate(nonzero_values)
-            residuals = np.concatenate(residuals)
-            nsegments = np.concatenate(nsegments)
-
-            row_idxs = [
-                i for i in range(len(nsegments))
-                  for j in range(nsegments[i])
-            ]
-            row_idxs = np.array(row_idxs)
-
-            matrix = scipy.sparse.coo_matrix(
-                (nonzero_values, (row_idxs, column_idxs)),
-                shape=(len(nsegments), nvoronoi)
+        if self.rank == ROOT_RANK:
+            index_keys = ["network", "station"]
+            arrivals = pd.concat(
+                [sample.assign(ireal=ireal) for ireal, sample in enumerate(samples)],
+                ignore_index=True
             )
+            arrivals = arrivals.set_index(index_keys)
+            arrivals = arrivals.sort_index()
 
-            self.sensitivity_matrix = matrix
-            self.residuals = residuals
+            # Dispatch each station with its arrivals.
+            items = arrivals.groupby(level=index_keys, sort=True)
+            self._dispatch(list(items), key=lambda item: item[0])
+
+            # The root rank holds no rows of its own.
+            buffers = [
+                (
+                    np.empty(0, dtype=_constants.DTYPE_INDEX),
+                    np.empty(0, dtype=_constants.DTYPE_INDEX),
+                    np.empty(0, dtype=_constants.DTYPE_REAL),
+                    np.empty(0, dtype=_constants.DTYPE_REAL)
+                )
+                for ireal in range(nreal)
+            ]
 
         else:
 
-            column_idxs = np.array([], dtype=_constants.DTYPE_INT)
-            nsegments = np.array([], dtype=_constants.DTYPE_INT)
-            nonzero_values = np.array([], dtype=_constants.DTYPE_REAL)
-            residuals = np.array([], dtype=_constants.DTYPE_REAL)
+            buffers = [
+                (
+                    _utilities.ArrayBuffer(_constants.DTYPE_INDEX),
+                    _utilities.ArrayBuffer(_constants.DTYPE_INDEX),
+                    _utilities.ArrayBuffer(_constants.DTYPE_REAL),
+                    _utilities.ArrayBuffer(_constants.DTYPE_REAL)
+                )
+                for ireal in range(nreal)
+            ]
+            if ray_projection == "labels":
+                indexes = [
+                    _voronoi.LabelIndex(
+                        _labels,
+                        len(_cells),
+                        self.pwave_model.min_coords,
+                        self.pwave_model.node_intervals
+                    )
+                    for _cells, _labels in zip(cells, labels)
+                ]
+            elif ray_projection == "kdtree":
+                indexes = [
+                    _voronoi.VoronoiIndex(_cells, workers=nthreads)
+                    for _cells in cells
+                ]
+            else:
+                raise (ValueError(
+                    f"Unrecognized ray_projection ({ray_projection}) supplied."
+                ))
 
             events = self.events.set_index("event_id")
             events = events.sort_index()
@@ -298,77 +444,196 @@ class InversionIterator(object):
                 item = self._request_dispatch()
 
                 if item is None:
-                    logger.debug("Sentinel received. Gathering sensitivity matrix.")
+                    logger.debug("Sentinel received. Compiling sensitivity matrices.")
 
-                    column_idxs = COMM.gather(column_idxs, root=ROOT_RANK)
-                    nsegments = COMM.gather(nsegments, root=ROOT_RANK)
-                    nonzero_values = COMM.gather(nonzero_values, root=ROOT_RANK)
-                    residuals = COMM.gather(residuals, root=ROOT_RANK)
+                    buffers = [
+                        tuple(buffer.array() for buffer in _buffers)
+                        for _buffers in buffers
+                    ]
 
                     break
 
-                network, station = item
-
-                # Get the subset of arrivals belonging to this station.
-                _arrivals = arrivals.loc[(network, station)]
-                _arrivals = _arrivals.set_index("event_id")
+                (network, station), _arrivals = item
 
                 # Initialize the ray tracer.
-                path = os.path.join(traveltime_dir, f"{network}.{station}.{phase}.npz")
-                traveltime = pykonal.fields.load(path)
+                traveltime = self.traveltime_store.load(network, station, phase)
 
                 # Load velocity model for calculating dt/dx
                 vel = pykonal.fields.load(vel)
 
                 step_size = traveltime.step_size
 
-                for event_id, arrival in _arrivals.iterrows():
+                # Trace each ray once for all realizations.
+                rays = dict()
+                for event_id in _arrivals["event_id"].unique():
                     event = events.loc[event_id]
-                    event_coords = event[["latitude", "longitude", "depth"]]
-                    event_coords = geo2sph(event_coords)
-                    raypath = traveltime.trace_ray(event_coords)
+                    _event_coords = event[["latitude", "longitude", "depth"]]
+                    _event_coords = geo2sph(_event_coords)
+                    raypath = self.ray_cache.trace(
+                        traveltime,
+                        (event_id, network, station, phase),
+                        _event_coords
+                    )
+                    rays[event_id] = (_event_coords, raypath)
+
+                for ireal in range(nreal):
+                    column_idxs, nsegments, nonzero_values, residuals = buffers[ireal]
+                    __arrivals = _arrivals[_arrivals["ireal"] == ireal]
+                    event_ids = __arrivals["event_id"].values
+                    raypaths = [rays[event_id][1] for event_id in event_ids]
+
                     if vel_invert: # For velocity inversion
-                        _column_idxs, counts = self._projected_ray_idxs(raypath)
-                        nonzero_values = np.append(nonzero_values, counts * step_size)
-                        column_idxs = np.append(column_idxs, _column_idxs)
-                        nsegments = np.append(nsegments, len(_column_idxs))
+                        # Project all of this station's rays in one batch.
+                        for _column_idxs, counts in self._projected_ray_idxs(raypaths, index=indexes[ireal]):
+                            nonzero_values.append(counts * step_size)
+                            column_idxs.append(_column_idxs)
+                            nsegments.append(len(_column_idxs))
                     else: # For hypocenter inversion
-                        _column_idxs, _nonnzero_values = self._calculate_hypo_sensitivity(event_id,event_coords,raypath,vel)
-                        column_idxs = np.append(column_idxs, _column_idxs)
-                        nonzero_values = np.append(nonzero_values,_nonnzero_values)
-                        nsegments = np.append(nsegments, len(_column_idxs))
-                    residuals = np.append(residuals, arrival["residual"])
+                        for event_id, raypath in zip(event_ids, raypaths):
+                            _event_coords = rays[event_id][0]
+                            _column_idxs, _nonnzero_values = self._calculate_hypo_sensitivity(event_id,_event_coords,raypath,vel)
+                            column_idxs.append(_column_idxs)
+                            nonzero_values.append(_nonnzero_values)
+                            nsegments.append(len(_column_idxs))
+                    residuals.append(__arrivals["residual"].values)
+
+        matrices = []
+
+        for column_idxs, nsegments, nonzero_values, residuals in buffers:
+
+            # Workers keep their own rows for a distributed solve;
+            # otherwise all rows are gathered to the root rank.
+            if distributed is False:
+                column_idxs = _collective.gatherv(column_idxs, comm=self.comm)
+                nsegments = _collective.gatherv(nsegments, comm=self.comm)
+                nonzero_values = _collective.gatherv(nonzero_values, comm=self.comm)
+                residuals = _collective.gatherv(residuals, comm=self.comm)
+
+            if self.rank == ROOT_RANK or distributed is True:
+                matrix = _linalg.assemble_csr(
+                    column_idxs,
+                    nsegments,
+                    nonzero_values,
+                    nvoronoi
+                )
+                matrices.append((matrix, residuals))
 
-        COMM.barrier()
+        self.comm.barrier()
+
+        if self.rank == ROOT_RANK or distributed is True:
+            return (matrices)
+
+        return (None)
+
+
+    @_utilities.log_errors(logger)
+    def _compute_realizations(self, realizations, adaptive_voronoi):
+        """
+        Compute a model update for each (phase, ireal) tuple in
+        *realizations* using the ranks of self.comm.
+
+        Consecutive realizations of the same phase are processed in
+        batches of up to "realization_batch_size", whose sensitivity
+        matrices are computed together.
+        """
+
+        nreal = self.cfg["algorithm"]["nreal"]
+        batch_size = self.cfg["algorithm"]["realization_batch_size"]
+
+        batches = []
+        for phase, ireal in realizations:
+            if (
+                len(batches) > 0
+                and batches[-1][0][0] == phase
+                and len(batches[-1]) < batch_size
+            ):
+                batches[-1].append((phase, ireal))
+            else:
+                batches.append([(phase, ireal)])
+
+        for batch in batches:
+            phase = batch[0][0]
+            samples, cells, labels = [], [], []
+            for _, ireal in batch:
+                logger.info(f"{phase}-wave realization #{ireal+1} (/{nreal})")
+                self._sample_arrivals(phase)
+                self._generate_voronoi_cells(
+                    adaptive=adaptive_voronoi,
+                    phase=phase
+                )
+                self._update_cell_labels()
+                samples.append(self.sampled_arrivals)
+                cells.append(self.voronoi_cells)
+                labels.append(self.cell_labels)
+
+            matrices = self._compute_sensitivity_matrices(
+                phase,
+                samples,
+                cells,
+                labels
+            )
+
+            for ibatch in range(len(batch)):
+                self.sampled_arrivals = samples[ibatch]
+                self.voronoi_cells = cells[ibatch]
+                self.cell_labels = labels[ibatch]
+                if matrices is not None:
+                    self.sensitivity_matrix, self.residuals = matrices[ibatch]
+                self._compute_model_update(phase)
 
         return (True)
 
 
     @_utilities.log_errors(logger)
-    def _dispatch(self, ids, sentinel=None):
+    def _dispatch(self, ids, sentinel=None, key=None):
         """
         Dispatch ids to hungry workers, then dispatch sentinels.
+
+        If *key* is given and dispatch affinity is enabled, each id is
+        preferentially sent to the rank that last received an id with
+        the same key (e.g., the same station) so that data cached by
+        that rank are reused. Ranks with no ids of their own are given
+        unclaimed ids first and then steal ids from other ranks.
         """
 
         logger.debug("Dispatching ids")
 
+        affinity = key is not None and self.cfg["parallel"]["dispatch_affinity"]
+
+        # Queue ids by the rank that last handled them; None indicates
+        # no preference.
+        queues = collections.defaultdict(collections.deque)
         for _id in ids:
-            requesting_rank = COMM.recv(
+            rank = self.dispatch_affinity.get(key(_id)) if affinity else None
+            queues[rank].append(_id)
+        nids = sum(map(len, queues.values()))
+
+        for iid in range(nids):
+            requesting_rank = self.comm.recv(
                 source=MPI.ANY_SOURCE,
                 tag=_constants.DISPATCH_REQUEST_TAG
             )
-            COMM.send(
+            if len(queues[requesting_rank]) > 0:
+                _id = queues[requesting_rank].popleft()
+            elif len(queues[None]) > 0:
+                _id = queues[None].popleft()
+            else:
+                # Steal from the back of the longest queue.
+                _id = max(queues.values(), key=len).pop()
+            if affinity:
+                self.dispatch_affinity[key(_id)] = requesting_rank
+            self.comm.send(
                 _id,
                 dest=requesting_rank,
                 tag=_constants.DISPATCH_TRANSMISSION_TAG
             )
         # Distribute sentinel.
-        for irank in range(WORLD_SIZE - 1):
-            requesting_rank = COMM.recv(
+        for irank in range(self.comm.Get_size() - 1):
+            requesting_rank = self.comm.recv(
                 source=MPI.ANY_SOURCE,
                 tag=_constants.DISPATCH_REQUEST_TAG
             )
-            COMM.send(
+            self.comm.send(
                 sentinel,
                 dest=requesting_rank,
                 tag=_constants.DISPATCH_TRANSMISSION_TAG
@@ -395,7 +660,7 @@ class InversionIterator(object):
         Generate randomly distributed Voronoi cells.
         """
 
-        if RANK == ROOT_RANK:
+        if self.rank == ROOT_RANK:
             min_coords = self.pwave_model.min_coords
             max_coords = self.pwave_model.max_coords
             delta = (max_coords - min_coords)
@@ -414,7 +679,9 @@ class InversionIterator(object):
         Generate Voronoi cells adaptively.
         """
 
-        if RANK == ROOT_RANK:
+        self.synchronize(attrs=["events"])
+
+        if self.rank == ROOT_RANK:
 
             nvoronoi = self.cfg["algorithm"]["nvoronoi"]
             arrivals = self.sampled_arrivals.sample(n=nvoronoi)
@@ -423,9 +690,9 @@ class InversionIterator(object):
             index = arrivals.index.unique()
             event_ids = [tuple(arrivals.loc[idx, "event_id"].values) for idx in index]
             items = zip(index, event_ids)
-            self._dispatch(items)
+            self._dispatch(items, key=lambda item: item[0])
 
-            voronoi_cells = COMM.gather(None, root=ROOT_RANK)
+            voronoi_cells = self.comm.gather(None, root=ROOT_RANK)
             voronoi_cells = filter(lambda item: item is not None, voronoi_cells)
             voronoi_cells = sum(voronoi_cells, [])
             voronoi_cells = np.stack(voronoi_cells)
@@ -433,7 +700,6 @@ class InversionIterator(object):
 
         else:
 
-            traveltime_dir = self.cfg["workspace"]["traveltime_dir"]
             events = self.events
             events = events.set_index("event_id")
 
@@ -444,20 +710,22 @@ class InversionIterator(object):
                 item = self._request_dispatch()
 
                 if item is None:
-                    COMM.gather(voronoi_cells, root=ROOT_RANK)
+                    self.comm.gather(voronoi_cells, root=ROOT_RANK)
                     break
 
                 (network, station), event_ids = item
 
-                filename = f"{network}.{station}.{phase}.npz"
-                path = os.path.join(traveltime_dir, filename)
-                traveltime = pykonal.fields.load(path)
+                traveltime = self.traveltime_store.load(network, station, phase)
 
                 for event_id in event_ids:
                     keys = ["latitude", "longitude", "depth"]
                     coords = events.loc[event_id, keys]
                     coords = geo2sph(coords)
-                    raypath = traveltime.trace_ray(coords)
+                    raypath = self.ray_cache.trace(
+                        traveltime,
+                        (event_id, network, station, phase),
+                        coords
+                    )
                     idx = np.random.choice(range(len(raypath)))
                     coords = raypath[idx]
                     voronoi_cells.append(coords)
@@ -468,19 +736,73 @@ class InversionIterator(object):
 
 
     @_utilities.log_errors(logger)
-    def _projected_ray_idxs(self, raypath):
+    def _merge_realization_stacks(self):
+        """
+        Move the realizations stacked by the root rank of each group
+        onto the realization stacks of ROOT_RANK.
+
+        All ranks must call this method.
+        """
+
+        for stack in (self.pwave_realization_stack, self.swave_realization_stack):
+            if RANK == ROOT_RANK or len(stack) == 0:
+                count = 0
+                mean = np.empty(0, dtype=_constants.DTYPE_REAL)
+                m2 = np.empty(0, dtype=_constants.DTYPE_REAL)
+                realizations = np.empty(0, dtype=_constants.DTYPE_REAL)
+            else:
+                count = len(stack)
+                mean = stack.mean.ravel()
+                m2 = stack.m2.ravel()
+                realizations = stack.realizations
+                if realizations is None:
+                    realizations = np.empty(0, dtype=_constants.DTYPE_REAL)
+                realizations = np.ravel(realizations)
+                stack.clear()
+
+            counts = COMM.gather(count, root=ROOT_RANK)
+            mean = _collective.gatherv(mean)
+            m2 = _collective.gatherv(m2)
+            realizations = _collective.gatherv(realizations)
+
+            if RANK == ROOT_RANK:
+                npts = self.pwave_model.npts
+                nnodes = np.prod(npts)
+                counts = list(filter(lambda count: count > 0, counts))
+                mean = mean.reshape(-1, *npts)
+                m2 = m2.reshape(-1, *npts)
+                if realizations.size > 0:
+                    realizations = np.split(
+                        realizations.reshape(-1, *npts),
+                        np.cumsum(counts)[:-1]
+                    )
+                else:
+                    realizations = [None] * len(counts)
+                for icount, count in enumerate(counts):
+                    stack.merge(count, mean[icount], m2[icount], realizations[icount])
+
+        COMM.barrier()
+
+        return (True)
+
+
+    @_utilities.log_errors(logger)
+    def _projected_ray_idxs(self, raypaths, index=None):
         """
         Return the cell IDs (column IDs) of each segment of the given
-        raypath and the length of each segment in counts.
+        raypaths and the length of each segment in counts.
+
+        Raypaths are projected onto the cells of *index*, or the
+        current Voronoi cells if None.
+
+        A list of (column_idxs, counts) tuples is returned with one
+        entry per raypath.
         """
 
-        voronoi_cells = sph2xyz(self.voronoi_cells, (0, 0, 0))
-        tree = scipy.spatial.cKDTree(voronoi_cells)
-        raypath = sph2xyz(raypath, (0, 0, 0))
-        _, column_idxs = tree.query(raypath)
-        column_idxs, counts = np.unique(column_idxs, return_counts=True)
+        if index is None:
+            index = self.voronoi_index
 
-        return (column_idxs, counts)
+        return (index.project(raypaths))
 
     def _calculate_hypo_sensitivity(event_id,event_coords,raypath,vel):
         '''
@@ -510,12 +832,12 @@ class InversionIterator(object):
         """
         Request, receive, and return item from dispatcher.
         """
-        COMM.send(
-            RANK,
+        self.comm.send(
+            self.rank,
             dest=ROOT_RANK,
             tag=_constants.DISPATCH_REQUEST_TAG
         )
-        item = COMM.recv(
+        item = self.comm.recv(
             source=ROOT_RANK,
             tag=_constants.DISPATCH_TRANSMISSION_TAG
         )
@@ -526,10 +848,10 @@ class InversionIterator(object):
     def _sample_arrivals(self, phase):
         """
         Draw a random sample of arrivals and update the
-        "sampled_arrivals" attribute.
+        "sampled_arrivals" attribute of the root rank.
         """
 
-        if RANK == ROOT_RANK:
+        if self.rank == ROOT_RANK:
             narrival = self.cfg["algorithm"]["narrival"]
             tukey_k = self.cfg["algorithm"]["outlier_removal_factor"]
 
@@ -538,6 +860,9 @@ class InversionIterator(object):
             arrivals = arrivals.sort_index()
             arrivals = arrivals.loc[phase]
 
+            # Remove arrivals outside their traveltime-lookup table.
+            arrivals = arrivals.dropna(subset=["residual"])
+
             # Remove outliers.
             q1, q3 = arrivals["residual"].quantile(q=[0.25, 0.75])
             iqr = q3 - q1
@@ -550,38 +875,155 @@ class InversionIterator(object):
 
             self.sampled_arrivals = arrivals.sample(n=narrival)
 
-        self.synchronize(attrs=["sampled_arrivals"])
+        return (True)
+
+
+    @_utilities.log_errors(logger)
+    def _share_traveltimes(self, phases):
+        """
+        Load every traveltime-lookup table of *phases* that has
+        arrivals into node-level shared memory, if "shared_traveltimes"
+        is enabled. Release with self.traveltime_store.unshare().
+
+        All ranks must call this method.
+        """
+
+        if self.cfg["parallel"]["shared_traveltimes"] is False:
+            return (False)
+
+        if self.cfg["algorithm"]["traveltime_domain"] != "full":
+            raise (ValueError("Shared traveltimes require the full traveltime domain."))
+
+        logger.info("Loading traveltime-lookup tables into shared memory.")
+
+        self.synchronize(attrs=["arrivals", "pwave_model"])
+
+        keys = self.arrivals[self.arrivals["phase"].isin(phases)]
+        keys = keys[["network", "station", "phase"]].drop_duplicates()
+        keys = sorted(map(tuple, keys.values))
+        self.traveltime_store.share(keys, self.pwave_model, COMM)
+
+        return (True)
+
+
+    def _touch(self, *attrs):
+        """
+        Mark *attrs* as modified so that they are broadcast by the next
+        call to synchronize() that names them.
+
+        Setters call this automatically; call it after modifying an
+        attribute in place.
+        """
+
+        for attr in attrs:
+            self._versions[attr] += 1
 
         return (True)
 
 
     @_utilities.log_errors(logger)
-    def _update_projection_matrix(self):
+    def _traveltime_domains(self, station_ids):
         """
-        Update the projection matrix using the current Voronoi cells.
+        Return a dictionary mapping (network, station, phase) tuples to
+        the index bounds of the sub-domain over which the corresponding
+        traveltime-lookup table is computed, or None for the full grid.
+
+        With the "events" domain, each table covers the station and the
+        relocation search window around every event with an arrival at
+        the station, over the full radial extent of the grid. With the "distance" domain, each table covers all
+        points within "max_event_distance" of the station epicenter.
         """
 
-        logger.info("Updating projection matrix")
+        domain = self.cfg["algorithm"]["traveltime_domain"]
+        margin = self.cfg["algorithm"]["traveltime_domain_margin"]
+        keys = ["latitude", "longitude", "depth"]
+
+        domains = {
+            (network, station, phase): None
+            for network, station in station_ids
+            for phase in ("P", "S")
+        }
+
+        if domain == "full":
+            return (domains)
+        elif domain not in ("events", "distance"):
+            raise (ValueError(f"Unrecognized traveltime domain ({domain})."))
+        elif self.traveltime_store.fmt == "memmap":
+            raise (ValueError("Memory-mapped stores require the full traveltime domain."))
+
+        stations = self.stations.set_index(["network", "station"])
+        events = self.events.set_index("event_id")
+        arrivals = self.arrivals.groupby(["network", "station", "phase"])
+        window = np.array([
+            self.cfg["locate"]["dlat"],
+            self.cfg["locate"]["dlon"],
+            self.cfg["locate"]["ddepth"]
+        ])
+        distance = self.cfg["algorithm"]["max_event_distance"]
+        if domain == "distance" and not np.isfinite(distance):
+            raise (ValueError(
+                "The distance traveltime domain requires a finite "
+                "max_event_distance."
+            ))
+
+        for network, station, phase in domains:
+            model = self.pwave_model if phase == "P" else self.swave_model
+            coords = stations.loc[(network, station), keys].values
+            coords = geo2sph(coords.astype(np.float64))
+            if domain == "events":
+                if (network, station, phase) in arrivals.groups:
+                    event_ids = arrivals.get_group((network, station, phase))["event_id"]
+                    _events = events.loc[event_ids, keys].values.astype(np.float64)
+                    # Spherical coordinates are monotonic in each
+                    # geographic coordinate, so the corners of each
+                    # search window bound it.
+                    corners = np.concatenate([_events - window, _events + window])
+                    coords = np.vstack([coords, geo2sph(corners)])
+                # Rays dive below both endpoints at regional distances,
+                # so only the angular extent is restricted.
+                coords = np.reshape(coords, (-1, 3))
+                coords = np.vstack([
+                    [model.min_coords[0], coords[0, 1], coords[0, 2]],
+                    [model.max_coords[0], coords[0, 1], coords[0, 2]],
+                    coords
+                ])
+            else:
+                dtheta = distance / _constants.EARTH_RADIUS
+                dphi = min(dtheta / np.sin(coords[1]), np.pi)
+                coords = np.array([
+                    [model.min_coords[0], coords[1] - dtheta, coords[2] - dphi],
+                    [model.max_coords[0], coords[1] + dtheta, coords[2] + dphi]
+                ])
+            bounds = _traveltime.domain_bounds(model, coords, margin=margin)
+            domains[(network, station, phase)] = bounds
+
+        return (domains)
 
-        nvoronoi = self.cfg["algorithm"]["nvoronoi"]
 
-        if RANK == ROOT_RANK:
-            voronoi_cells = sph2xyz(self.voronoi_cells, origin=(0,0,0))
-            tree = scipy.spatial.cKDTree(voronoi_cells)
-            nodes = self.pwave_model.nodes.reshape(-1, 3)
-            nodes = sph2xyz(nodes, origin=(0,0,0))
-            _, column_ids = tree.query(nodes)
+    @_utilities.log_errors(logger)
+    def _update_cell_labels(self):
+        """
+        Label each grid node with the index of the Voronoi cell
+        containing it.
 
-            nnodes = np.prod(self.pwave_model.nodes.shape[:-1])
-            row_ids = np.arange(nnodes)
+        Labels are only broadcast to workers if "ray_projection" is
+        "labels"; otherwise only the root rank uses them.
+        """
 
-            values = np.ones(nnodes,)
-            self.projection_matrix = scipy.sparse.coo_matrix(
-                (values, (row_ids, column_ids)),
-                shape=(nnodes, nvoronoi)
-            )
+        logger.info("Updating Voronoi-cell labels")
+
+        if self.rank == ROOT_RANK:
+            nodes = self.pwave_model.nodes.reshape(-1, 3)
+            labels = self.voronoi_index.query(nodes)
+            labels = labels.astype(_constants.DTYPE_INDEX)
+            labels = labels.reshape(self.pwave_model.npts)
+        else:
+            labels = None
 
-        self.synchronize(attrs=["projection_matrix"])
+        if self.cfg["algorithm"]["ray_projection"] == "labels":
+            labels = _collective.bcast_array(labels, comm=self.comm)
+
+        self.cell_labels = labels
 
         return (True)
 
@@ -594,51 +1036,171 @@ class InversionIterator(object):
 
         logger.info("Computing traveltime-lookup tables.")
 
+        self.synchronize(attrs=["cfg", "pwave_model", "swave_model", "stations"])
+
         traveltime_dir = self.cfg["workspace"]["traveltime_dir"]
+        keys = ["latitude", "longitude", "depth"]
+
+        geometry = self.stations
+        geometry = geometry.set_index(["network", "station"])
+
+        store = self.traveltime_store
+
+        # Report cache usage since the tables were last rewritten.
+        caches = (("Traveltime", store), ("Ray", self.ray_cache))
+        for name, cache in caches:
+            statistics = COMM.gather(cache.statistics, root=ROOT_RANK)
+            if RANK == ROOT_RANK:
+                hits, misses = np.sum(statistics, axis=0)
+                if hits + misses > 0:
+                    logger.info(f"{name} cache: {hits} hits, {misses} misses.")
+            cache.reset_statistics()
+        store.close()
+        self.ray_cache.clear()
 
         if RANK == ROOT_RANK:
 
             os.makedirs(traveltime_dir, exist_ok=True)
-            ids = zip(self.stations["network"], self.stations["station"])
-            self._dispatch(sorted(ids))
+
+            # Only dispatch tables whose model and station location
+            # differ from those recorded in the manifest.
+            if self.cfg["workspace"]["reuse_traveltimes"] is True:
+                manifest = _traveltime.load_manifest(traveltime_dir)
+            else:
+                manifest = dict()
+            model_digests = dict(
+                P=_traveltime.model_digest(self.pwave_model),
+                S=_traveltime.model_digest(self.swave_model)
+            )
+
+            # Discard manifest entries for tables the store could not
+            # retain (e.g., because the station set changed).
+            station_ids = sorted(geometry.index)
+            domains = self._traveltime_domains(station_ids)
+            for phase, model in (("P", self.pwave_model), ("S", self.swave_model)):
+                if store.initialize(phase, station_ids, model) is False:
+                    manifest = {
+                        filename: digest
+                        for filename, digest in manifest.items()
+                        if not filename.endswith(f".{phase}.npz")
+                    }
+
+            ids, updates = [], dict()
+            for network, station in station_ids:
+                coords = geometry.loc[(network, station), keys].values
+                for phase in ("P", "S"):
+                    filename = _traveltime.table_name(network, station, phase)
+                    bounds = domains[(network, station, phase)]
+                    digest = _traveltime.table_digest(
+                        model_digests[phase],
+                        coords,
+                        encoding=store.encoding,
+                        bounds=bounds
+                    )
+                    if manifest.get(filename) == digest \
+                            and store.exists(network, station, phase):
+                        continue
+                    manifest.pop(filename, None)
+                    updates[filename] = digest
+                    ids.append((network, station, phase, bounds))
+
+            logger.info(
+                f"Reusing {2*len(geometry)-len(ids)} of {2*len(geometry)} "
+                "traveltime-lookup tables."
+            )
+
+            # Drop stale entries before any table is overwritten.
+            _traveltime.save_manifest(traveltime_dir, manifest)
+            self._dispatch(ids)
+
+            # Report the largest error introduced by the storage precision.
+            errors = COMM.gather(None, root=ROOT_RANK)
+            error = max(filter(lambda x: x is not None, errors), default=0.)
+            logger.info(
+                f"Maximum traveltime error due to {store.precision} "
+                f"storage: {error:.3g} s."
+            )
 
         else:
 
-            geometry = self.stations
-            geometry = geometry.set_index(["network", "station"])
+            nthreads = self.cfg["parallel"]["nthreads"]
+            if self.cfg["parallel"]["pool"] == "process":
+                Executor = concurrent.futures.ProcessPoolExecutor
+            else:
+                Executor = concurrent.futures.ThreadPoolExecutor
+            models = dict(P=self.pwave_model, S=self.swave_model)
 
-            while True:
+            error = 0.
+            futures = set()
 
-                # Request an event
-                item = self._request_dispatch()
+            # Solve up to nthreads tables concurrently, requesting a new
+            # item each time a solve completes.
+            with Executor(
+                max_workers=nthreads,
+                initializer=_traveltime.initialize_solver,
+                initargs=(store, models)
+            ) as executor:
 
-                if item is None:
-                    logger.debug("Received sentinel.")
+                while True:
 
-                    break
+                    if len(futures) >= nthreads:
+                        done, futures = concurrent.futures.wait(
+                            futures,
+                            return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            error = max(error, future.result())
+
+                    # Request an event
+                    item = self._request_dispatch()
+
+                    if item is None:
+                        logger.debug("Received sentinel.")
+
+                        break
+
+                    network, station, phase, bounds = item
+
+                    coords = geometry.loc[(network, station), keys]
+                    coords = geo2sph(coords)
 
-                network, station = item
-
-                keys = ["latitude", "longitude", "depth"]
-                coords = geometry.loc[(network, station), keys]
-                coords = geo2sph(coords)
-
-                for phase, model in (("P", self.pwave_model), ("S", self.swave_model)):
-                    solver = PointSourceSolver(coord_sys="spherical")
-                    solver.vv.min_coords = model.min_coords
-                    solver.vv.node_intervals = model.node_intervals
-                    solver.vv.npts = model.npts
-                    solver.vv.values = model.values
-                    solver.src_loc = coords
-                    solver.solve()
-                    path = os.path.join(
-                        traveltime_dir,
-                        f"{network}.{station}.{phase}.npz"
+                    future = executor.submit(
+                        _traveltime.solve_table,
+                        network,
+                        station,
+                        phase,
+                        coords,
+                        bounds=bounds
                     )
-                    solver.tt.savez(path)
+                    futures.add(future)
+
+                for future in concurrent.futures.as_completed(futures):
+                    error = max(error, future.result())
+
+            COMM.gather(error, root=ROOT_RANK)
 
         COMM.barrier()
 
+        if RANK == ROOT_RANK:
+            manifest.update(updates)
+            _traveltime.save_manifest(traveltime_dir, manifest)
+
+        return (True)
+
+
+    @_utilities.log_errors(logger)
+    @_utilities.root_only(RANK)
+    def finalize(self):
+        """
+        Wait for background writes to finish and raise any error they
+        encountered.
+        """
+
+        if self._writer is not None:
+            logger.info("Waiting for outputs to be written.")
+            self._writer.close()
+            self._writer = None
+
         return (True)
 
 
@@ -653,23 +1215,51 @@ class InversionIterator(object):
         nreal = self.cfg["algorithm"]["nreal"]
         output_dir = self.cfg["workspace"]["output_dir"]
         adaptive_voronoi = self.cfg["algorithm"]["adaptive_voronoi_cells"]
+        ngroups = self.cfg["parallel"]["ngroups"]
 
         self.iiter += 1
 
         logger.info(f"Iteration #{self.iiter} (/{niter}).")
 
-        for phase in ("P", "S"):
-            logger.info(f"Updating {phase}-wave model")
-            for ireal in range(nreal):
-                logger.info(f"Realization #{ireal+1} (/{nreal})")
-                self._sample_arrivals(phase)
-                self._generate_voronoi_cells(
-                    adaptive=adaptive_voronoi,
-                    phase=phase
-                )
-                self._update_projection_matrix()
-                self._compute_sensitivity_matrix(phase)
-                self._compute_model_update(phase)
+        # Tables from the previous iteration are invalid if the grid
+        # resolution changes.
+        if self.update_grid() is True:
+            self.compute_traveltime_lookup_tables()
+
+        if ngroups == 1:
+            for phase in ("P", "S"):
+                logger.info(f"Updating {phase}-wave model")
+                self._share_traveltimes([phase])
+                realizations = [(phase, ireal) for ireal in range(nreal)]
+                self._compute_realizations(realizations, adaptive_voronoi)
+                self.traveltime_store.unshare()
+        else:
+            logger.info(f"Updating P- and S-wave models in {ngroups} groups")
+            if WORLD_SIZE < 2 * ngroups:
+                raise (ValueError(
+                    f"At least two ranks per group are required; "
+                    f"{WORLD_SIZE} ranks cannot form {ngroups} groups."
+                ))
+            self._share_traveltimes(["P", "S"])
+            # The root rank of each group samples arrivals.
+            self.synchronize(attrs=["arrivals", "events"])
+            realizations = [
+                (phase, ireal)
+                for phase in ("P", "S")
+                for ireal in range(nreal)
+            ]
+            # Deal realizations to groups round robin so that each group
+            # has a similar mix of phases.
+            igroup = RANK % ngroups
+            self.comm = COMM.Split(color=igroup, key=RANK)
+            self._compute_realizations(
+                realizations[igroup::ngroups],
+                adaptive_voronoi
+            )
+            self.comm.Free()
+            self.comm = None
+            self._merge_realization_stacks()
+            self.traveltime_store.unshare()
         self.update_models()
         self.compute_traveltime_lookup_tables()
         self.relocate_events()
@@ -761,6 +1351,10 @@ class InversionIterator(object):
 
         self.synchronize(attrs=["pwave_model", "swave_model"])
 
+        # Start at the first scheduled resolution so that the initial
+        # traveltime-lookup tables are not computed at full resolution.
+        self.update_grid()
+
         return (True)
 
 
@@ -772,15 +1366,20 @@ class InversionIterator(object):
 
         logger.info("Relocating events.")
 
+        self.synchronize(
+            attrs=["arrivals", "events", "pwave_model", "swave_model", "stations"]
+        )
+
         traveltime_dir = self.cfg["workspace"]["traveltime_dir"]
+        self._share_traveltimes(["P", "S"])
+
         if RANK == ROOT_RANK:
             ids = self.events["event_id"]
             self._dispatch(sorted(ids))
 
             logger.debug("Dispatch complete. Gathering events.")
             # Gather and concatenate events from all workers.
-            events = COMM.gather(None, root=ROOT_RANK)
-            events = pd.concat(events, ignore_index=True)
+            events = _collective.gather_dataframe(None)
             events = events.convert_dtypes()
             self.events = events
 
@@ -813,7 +1412,12 @@ class InversionIterator(object):
             dz = self.cfg["locate"]["ddepth"]
             dt = self.cfg["locate"]["dtime"]
 
+            store = self.traveltime_store
             events = pd.DataFrame()
+            events_in = self.events.set_index("event_id")
+            keys = ["latitude", "longitude", "depth"]
+            window = np.array([dlat, dlon, dz])
+            tables = dict()
 
             while True:
 
@@ -822,7 +1426,7 @@ class InversionIterator(object):
 
                 if event_id is None:
                     logger.debug("Received sentinel, gathering events.")
-                    COMM.gather(events, root=ROOT_RANK)
+                    _collective.gather_dataframe(events)
 
                     break
 
@@ -830,7 +1434,52 @@ class InversionIterator(object):
 
                 # Clear arrivals from previous event.
                 locator.clear_arrivals()
-                locator.add_arrivals(arrival_dict(self.arrivals, event_id))
+                _arrivals = arrival_dict(self.arrivals, event_id)
+
+                # Search-window corners of the event. Spherical
+                # coordinates are monotonic in each geographic
+                # coordinate, so the corners bound the window.
+                coords = events_in.loc[event_id, keys].values.astype(np.float64)
+                corners = geo2sph(np.stack([coords - window, coords + window]))
+
+                # Load tables through the store so that every storage
+                # format is supported; the locator only reads NPZ files.
+                # Picks whose sub-domain table does not cover the search
+                # window are excluded rather than penalized.
+                for station_id, phase in list(_arrivals):
+                    if (station_id, phase) not in tables:
+                        network, station = station_id.split(".", 1)
+                        tables[(station_id, phase)] = store.load(network, station, phase)
+                    traveltime = tables[(station_id, phase)]
+                    covered = _traveltime.covers(
+                        traveltime,
+                        corners,
+                        grid=self.pwave_model
+                    )
+                    if covered is False:
+                        _arrivals.pop((station_id, phase))
+                        continue
+                    if (station_id, phase) not in locator.traveltimes:
+                        # The locator expects tables on its own grid. The
+                        # padding lies outside the search window of every
+                        # pick that uses the table.
+                        locator.traveltimes[(station_id, phase)] = _traveltime.expand(
+                            traveltime,
+                            self.pwave_model,
+                            fill_value=1e6
+                        )
+
+                if len(_arrivals) == 0:
+                    logger.warning(
+                        f"No traveltime-lookup table covers event #{event_id}; "
+                        "keeping its current location."
+                    )
+                    event = events_in.loc[[event_id], columns[:4]]
+                    event = event.assign(residual=np.nan, event_id=event_id)
+                    events = events.append(event, ignore_index=True)
+                    continue
+
+                locator.add_arrivals(_arrivals)
                 locator.load_traveltimes()
                 loc = locator.locate(dlat=dlat, dlon=dlon, dz=dz, dt=dt)
 
@@ -844,7 +1493,10 @@ class InversionIterator(object):
                 )
                 events = events.append(event, ignore_index=True)
 
-        self.synchronize(attrs=["events"])
+        self.traveltime_store.unshare()
+
+        # Raypaths end at the previous event locations.
+        self.ray_cache.clear()
 
         return (True)
 
@@ -888,7 +1540,14 @@ class InversionIterator(object):
         "events" and "arrivals" are written to a HDF5 file
         using pandas.HDFStore and the remaining attributes
         are written to a NPZ file with handles "pwave_model",
-        "swave_model", "pwave_stack", "swave_stack".
+        "swave_model", "pwave_stack", "swave_stack". If "output_format"
+        is "hdf5", everything is instead written to a single HDF5 store
+        (see _dataio.write_iteration_hdf5), and each iteration stores
+        only the realizations added since the last save on the same
+        grid.
+
+        If "async_save" is enabled, a snapshot of these attributes is
+        written by a background thread; call finalize() before exiting.
         """
 
         logger.info(f"Saving data from iteration #{self.iiter}")
@@ -896,21 +1555,24 @@ class InversionIterator(object):
         os.makedirs(output_dir, exist_ok=True)
         path = os.path.join(output_dir, f"{self.iiter:02d}")
 
+        models, arrays = dict(), None
         if self.iiter > 0:
-            self.pwave_model.savez(path + ".pwave_model")
-            self.swave_model.savez(path + ".swave_model")
-            pwave_stack = np.stack(self.pwave_realization_stack)
-            swave_stack = np.stack(self.pwave_realization_stack)
-            np.savez(
-                f"{path}.realizations.npz",
-                pwave_stack=pwave_stack,
+            models["pwave_model"] = self.pwave_model
+            models["swave_model"] = self.swave_model
+            arrays = dict(
                 pwave_variance=self.pwave_variance,
-                swave_stack=swave_stack,
                 swave_variance=self.swave_variance,
                 min_coords=self.pwave_model.min_coords,
                 node_intervals=self.pwave_model.node_intervals,
                 npts=self.pwave_model.npts
             )
+            # Full realizations are only available if they are kept.
+            pwave_stack = self.pwave_realization_stack.realizations
+            swave_stack = self.swave_realization_stack.realizations
+            if pwave_stack is not None:
+                arrays["pwave_stack"] = pwave_stack
+            if swave_stack is not None:
+                arrays["swave_stack"] = swave_stack
 
         events       = self.events
         EVENT_DTYPES = _constants.EVENT_DTYPES
@@ -922,19 +1584,49 @@ class InversionIterator(object):
         for column in ARRIVAL_DTYPES:
             arrivals[column] = arrivals[column].astype(ARRIVAL_DTYPES[column])
 
-        events.to_hdf(f"{path}.events.h5", key="events")
-        arrivals.to_hdf(f"{path}.events.h5", key="arrivals")
+        if self.cfg["workspace"]["output_format"] == "hdf5":
+            stack_offsets = dict()
+            for name in ("pwave_stack", "swave_stack"):
+                if arrays is None or name not in arrays:
+                    continue
+                offset = self._saved_realizations.get(name, 0)
+                stack_offsets[name] = offset
+                self._saved_realizations[name] = len(arrays[name])
+                arrays[name] = arrays[name][offset:]
+            write = functools.partial(
+                _dataio.write_iteration_hdf5,
+                os.path.join(output_dir, _dataio.OUTPUT_FILENAME),
+                self.iiter,
+                complevel=self.cfg["workspace"]["output_compression"],
+                stack_offsets=stack_offsets
+            )
+        else:
+            write = functools.partial(_dataio.write_iteration, path)
+
+        if self.cfg["workspace"]["async_save"] is False:
+            write(models, arrays, events, arrivals)
+            return (True)
+
+        # Write a snapshot in the background. Stacked realizations and
+        # variances are already new arrays.
+        models = {
+            name: copy.deepcopy(model)
+            for name, model in models.items()
+        }
+        self.writer.submit(write, models, arrays, events.copy(), arrivals.copy())
 
         return(True)
 
 
 
     @_utilities.log_errors(logger)
-    def synchronize(self, attrs="all"):
+    def synchronize(self, attrs="all", force=False):
         """
         Synchronize input data across all processes.
 
         "attrs" may be an iterable of attribute names to synchronize.
+        Only attributes modified on the root rank since they were last
+        synchronized are broadcast, unless *force* is True.
         """
 
 
@@ -942,7 +1634,6 @@ class InversionIterator(object):
             "arrivals",
             "cfg",
             "events",
-            "projection_matrix",
             "pwave_model",
             "swave_model",
             "sampled_arrivals",
@@ -953,12 +1644,24 @@ class InversionIterator(object):
         if attrs == "all":
             attrs = _all
 
+        if self.rank == ROOT_RANK:
+            attrs = [
+                attr for attr in attrs
+                if force is True
+                or self._synchronized_versions.get(attr) != self._versions[attr]
+            ]
+        else:
+            attrs = None
+        attrs = self.comm.bcast(attrs, root=ROOT_RANK)
+
         for attr in attrs:
-            value = getattr(self, attr) if RANK == ROOT_RANK else None
-            value = COMM.bcast(value, root=ROOT_RANK)
+            value = getattr(self, attr) if self.rank == ROOT_RANK else None
+            value = _collective.bcast(value, comm=self.comm)
             setattr(self, attr, value)
+            if self.rank == ROOT_RANK:
+                self._synchronized_versions[attr] = self._versions[attr]
 
-        COMM.barrier()
+        self.comm.barrier()
 
         return (True)
 
@@ -973,16 +1676,16 @@ class InversionIterator(object):
 
         logger.info("Updating arrival residuals.")
 
-        traveltime_dir = self.cfg["workspace"]["traveltime_dir"]
+        self.synchronize(attrs=["arrivals", "events"])
+
         arrivals = self.arrivals.set_index(["network", "station", "phase"])
         arrivals = arrivals.sort_index()
 
         if RANK == ROOT_RANK:
             ids = arrivals.index.unique()
-            self._dispatch(ids)
+            self._dispatch(ids, key=lambda item: item[:2])
             logger.debug("Dispatch complete. Gathering arrivals.")
-            arrivals = COMM.gather(None, root=ROOT_RANK)
-            arrivals = pd.concat(arrivals, ignore_index=True)
+            arrivals = _collective.gather_dataframe(None)
             arrivals = arrivals.convert_dtypes()
             self.arrivals = arrivals
 
@@ -998,7 +1701,7 @@ class InversionIterator(object):
 
                 if item is None:
                     logger.debug("Received sentinel. Gathering arrivals.")
-                    COMM.gather(updated_arrivals, root=ROOT_RANK)
+                    _collective.gather_dataframe(updated_arrivals)
 
                     break
 
@@ -1006,8 +1709,7 @@ class InversionIterator(object):
                 network, station, phase = item
                 logger.debug(f"Updating {phase}-wave residuals for {network}.{station}.")
 
-                path = os.path.join(traveltime_dir, f"{network}.{station}.{phase}.npz")
-                traveltime = pykonal.fields.load(path)
+                traveltime = self.traveltime_store.load(network, station, phase)
 
                 _arrivals = arrivals.loc[(network, station, phase)]
                 _arrivals = _arrivals.set_index("event_id")
@@ -1017,7 +1719,12 @@ class InversionIterator(object):
                     origin_time = events.loc[event_id, "time"]
                     coords = events.loc[event_id, ["latitude", "longitude", "depth"]]
                     coords = geo2sph(coords)
-                    residual = arrival_time - (origin_time + traveltime.value(coords))
+                    # Sub-domain tables may not cover the event; leave
+                    # the residual undefined so the arrival is not used.
+                    if _traveltime.covers(traveltime, coords) is False:
+                        residual = np.nan
+                    else:
+                        residual = arrival_time - (origin_time + traveltime.value(coords))
                     arrival = dict(
                         network=network,
                         station=station,
@@ -1029,7 +1736,65 @@ class InversionIterator(object):
                     arrival = pd.DataFrame([arrival])
                     updated_arrivals = updated_arrivals.append(arrival, ignore_index=True)
 
-        self.synchronize(attrs=["arrivals"])
+        return (True)
+
+    @_utilities.log_errors(logger)
+    def update_grid(self):
+        """
+        Resample velocity models (and any accumulated realizations) to
+        the grid resolution scheduled for the current iteration.
+
+        The grid for iteration *i* is the initial model grid decimated
+        by the *i*-th factor of the "decimation_schedule"; the first
+        factor also applies before the first iteration and the last
+        factor to all subsequent iterations. Returns True if the grid
+        changed.
+        """
+
+        schedule = self.cfg["algorithm"]["decimation_schedule"]
+        factor = schedule[min(max(self.iiter, 1), len(schedule)) - 1]
+
+        if factor == self._decimation:
+            return (False)
+
+        logger.info(f"Resampling models to 1/{factor} of the initial resolution.")
+
+        if RANK == ROOT_RANK:
+            if self._full_grid is None:
+                self._full_grid = dict(
+                    min_coords=np.array(self.pwave_model.min_coords),
+                    node_intervals=np.array(self.pwave_model.node_intervals),
+                    npts=np.array(self.pwave_model.npts)
+                )
+            grid = _picklable.ScalarField3D(coord_sys="spherical")
+            grid.min_coords = self._full_grid["min_coords"]
+            # Keep the full extent of the initial grid, so that nodes are
+            # at most *factor* initial intervals apart.
+            nintervals = self._full_grid["npts"] - 1
+            grid.npts = -(-nintervals // factor) + 1
+            grid.node_intervals = np.where(
+                grid.npts > 1,
+                self._full_grid["node_intervals"] * nintervals / np.maximum(grid.npts - 1, 1),
+                self._full_grid["node_intervals"]
+            )
+
+            for stack in (self.pwave_realization_stack, self.swave_realization_stack):
+                stack.transform(lambda values: resample(values, self.pwave_model, grid))
+            # Resampled realizations must be saved again in full.
+            self._saved_realizations.clear()
+
+            models = []
+            for model in (self.pwave_model, self.swave_model):
+                _model = _picklable.ScalarField3D(coord_sys="spherical")
+                _model.min_coords = grid.min_coords
+                _model.node_intervals = grid.node_intervals
+                _model.npts = grid.npts
+                _model.values = resample(model.values, model, grid)
+                models.append(_model)
+            self.pwave_model, self.swave_model = models
+
+        self._decimation = factor
+        self.synchronize(attrs=["pwave_model", "swave_model"])
 
         return (True)
 
@@ -1041,11 +1806,11 @@ class InversionIterator(object):
         """
 
         if RANK == ROOT_RANK:
-            stack = np.stack(self.pwave_realization_stack)
-            self.pwave_model.values = np.mean(stack, axis=0)
+            # Stacks update their means in place, so copy them.
+            self.pwave_model.values = np.array(self.pwave_realization_stack.mean)
+            self.swave_model.values = np.array(self.swave_realization_stack.mean)
 
-            stack = np.stack(self.swave_realization_stack)
-            self.swave_model.values = np.mean(stack, axis=0)
+            self._touch("pwave_model", "swave_model")
 
         self.synchronize(attrs=["pwave_model", "swave_model"])
 
@@ -1076,6 +1841,38 @@ def arrival_dict(dataframe, event_id):
     return (_arrival_dict)
 
 
+@_utilities.log_errors(logger)
+def resample(values, source, target):
+    """
+    Return *values* defined on the grid of *source* linearly
+    interpolated onto the nodes of *target*'s grid.
+
+    *source* and *target* need only have "min_coords", "node_intervals",
+    and "npts" attributes. Target nodes outside the source grid are
+    linearly extrapolated.
+    """
+
+    axes = [
+        source.min_coords[iax] + np.arange(source.npts[iax]) * source.node_intervals[iax]
+        for iax in range(3)
+    ]
+    interpolator = scipy.interpolate.RegularGridInterpolator(
+        axes,
+        values,
+        bounds_error=False,
+        fill_value=None
+    )
+
+    nodes = [
+        target.min_coords[iax] + np.arange(target.npts[iax]) * target.node_intervals[iax]
+        for iax in range(3)
+    ]
+    nodes = np.stack(np.meshgrid(*nodes, indexing="ij"), axis=-1)
+    _values = interpolator(nodes.reshape(-1, 3)).reshape(nodes.shape[:-1])
+
+    return (_values)
+
+
 @_utilities.log_errors(logger)
 def station_dict(dataframe):
     """
@@ -0,0 +1,272 @@
+"""
+A module defining linear-algebra routines for the inversion.
+
+.. date:: 2026-10-16
+"""
+
+import mpi4py.MPI as MPI
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+import _collective
+import _constants
+
+COMM = MPI.COMM_WORLD
+
+
+def assemble_csr(column_idxs, nsegments, nonzero_values, ncols):
+    """
+    Return a CSR matrix with *ncols* columns whose rows are stored
+    contiguously in *column_idxs* and *nonzero_values*, with
+    *nsegments* nonzero values per row.
+    """
+
+    # Rows are contiguous, so the row pointer is simply the cumulative
+    # number of segments per row.
+    row_ptr = np.zeros(len(nsegments) + 1, dtype=_constants.DTYPE_INDEX)
+    np.cumsum(nsegments, out=row_ptr[1:])
+
+    matrix = scipy.sparse.csr_matrix(
+        (nonzero_values, column_idxs, row_ptr),
+        shape=(len(nsegments), ncols)
+    )
+
+    return (matrix)
+
+
+def distributed_operator(matrix, comm=COMM):
+    """
+    Return a LinearOperator representing the vertical stack, in rank
+    order, of the row blocks *matrix* held by every rank of *comm*.
+
+    Every rank must call the operator's methods collectively with the
+    same (replicated) vectors. Products with the operator are gathered
+    with Allgatherv and products with its transpose are summed with
+    Allreduce, so no rank ever holds more than its own rows.
+    """
+
+    matrix = scipy.sparse.csr_matrix(matrix)
+    rank = comm.Get_rank()
+
+    counts = np.array(comm.allgather(matrix.shape[0]), dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    start, stop = offsets[rank], offsets[rank+1]
+    nrows, ncols = counts.sum(), matrix.shape[1]
+    transpose = matrix.T.tocsr()
+
+    def matvec(x):
+        y = matrix @ np.ravel(x).astype(_constants.DTYPE_REAL)
+        return (_collective.allgatherv(y, comm=comm))
+
+    def rmatvec(y):
+        x = transpose @ np.ravel(y)[start: stop].astype(_constants.DTYPE_REAL)
+        x = np.ascontiguousarray(x, dtype=_constants.DTYPE_REAL)
+        comm.Allreduce(MPI.IN_PLACE, x, op=MPI.SUM)
+        return (x)
+
+    operator = scipy.sparse.linalg.LinearOperator(
+        (nrows, ncols),
+        matvec=matvec,
+        rmatvec=rmatvec,
+        dtype=_constants.DTYPE_REAL
+    )
+
+    return (operator)
+
+
+def column_norms(matrix, comm=None):
+    """
+    Return the Euclidean norm of each column of *matrix*, or of the
+    vertical stack of the row blocks held by every rank of *comm* if
+    given. Norms of empty columns are set to one.
+    """
+
+    matrix = scipy.sparse.csr_matrix(matrix)
+    norms = np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel()
+    norms = np.ascontiguousarray(norms, dtype=_constants.DTYPE_REAL)
+
+    if comm is not None:
+        comm.Allreduce(MPI.IN_PLACE, norms, op=MPI.SUM)
+
+    norms = np.sqrt(norms)
+    norms[norms == 0] = 1
+
+    return (norms)
+
+
+def _solve_cgls(matrix, rhs, damp, atol, btol, conlim, maxiter):
+    """
+    Solve with conjugate gradients on the (damped) normal equations.
+
+    Iteration stops once the norm of the normal-equation residual
+    falls below *atol* times its initial value. *btol* and *conlim*
+    are unused.
+    """
+
+    operator = scipy.sparse.linalg.aslinearoperator(matrix)
+    maxiter = 2 * operator.shape[1] if maxiter is None else maxiter
+
+    x = np.zeros(operator.shape[1], dtype=_constants.DTYPE_REAL)
+    r = np.array(rhs, dtype=_constants.DTYPE_REAL)
+    s = operator.rmatvec(r)
+    p = s.copy()
+    gamma = np.dot(s, s)
+    tolerance = atol * np.sqrt(gamma)
+
+    itn = 0
+    while itn < maxiter and np.sqrt(gamma) > tolerance:
+        itn += 1
+        q = operator.matvec(p)
+        delta = np.dot(q, q) + damp**2 * np.dot(p, p)
+        if delta == 0:
+            break
+        alpha = gamma / delta
+        x += alpha * p
+        r -= alpha * q
+        s = operator.rmatvec(r) - damp**2 * x
+        _gamma = np.dot(s, s)
+        p = s + (_gamma / gamma) * p
+        gamma = _gamma
+
+    return (x, itn, np.sqrt(np.dot(r, r) + damp**2 * np.dot(x, x)))
+
+
+def _solve_dense(matrix, rhs, damp, atol, btol, conlim, maxiter):
+    """
+    Solve directly with numpy.linalg.lstsq, appending damp times the
+    identity to the matrix. Only *damp* is used.
+    """
+
+    if scipy.sparse.issparse(matrix):
+        matrix = matrix.toarray()
+    matrix = np.asarray(matrix, dtype=_constants.DTYPE_REAL)
+    ncols = matrix.shape[1]
+
+    if damp > 0:
+        _matrix = np.vstack([matrix, damp * np.eye(ncols)])
+        _rhs = np.concatenate([rhs, np.zeros(ncols)])
+    else:
+        _matrix, _rhs = matrix, rhs
+
+    x, _, _, _ = np.linalg.lstsq(_matrix, _rhs, rcond=None)
+
+    return (x, 0, np.linalg.norm(_rhs - _matrix @ x))
+
+
+def _solve_lsmr(matrix, rhs, damp, atol, btol, conlim, maxiter):
+    """
+    Solve with scipy.sparse.linalg.lsmr.
+    """
+
+    result = scipy.sparse.linalg.lsmr(
+        matrix,
+        rhs,
+        damp,
+        atol,
+        btol,
+        conlim,
+        maxiter,
+        show=False
+    )
+    x, istop, itn, normr, normar, norma, conda, normx = result
+
+    return (x, itn, normr)
+
+
+def _solve_lsqr(matrix, rhs, damp, atol, btol, conlim, maxiter):
+    """
+    Solve with scipy.sparse.linalg.lsqr.
+    """
+
+    result = scipy.sparse.linalg.lsqr(
+        matrix,
+        rhs,
+        damp,
+        atol,
+        btol,
+        conlim,
+        maxiter,
+        show=False
+    )
+    x, istop, itn, r1norm, r2norm = result[:5]
+
+    return (x, itn, r2norm)
+
+
+# Least-squares solvers selectable by the "solver" configuration
+# parameter. Each takes the arguments of solve() after *solver* and
+# returns the solution, the number of iterations, and the norm of the
+# damped residual, sqrt(|b - Ax|^2 + damp^2 |x|^2).
+SOLVERS = dict(
+    cgls=_solve_cgls,
+    dense=_solve_dense,
+    lsmr=_solve_lsmr,
+    lsqr=_solve_lsqr
+)
+
+
+def solve(
+    matrix,
+    rhs,
+    solver="lsmr",
+    damp=0.,
+    atol=1e-8,
+    btol=1e-8,
+    conlim=1e8,
+    maxiter=None,
+    precondition=False,
+    comm=None
+):
+    """
+    Solve the damped least-squares problem min |Ax - b|^2 + damp^2 |x|^2
+    for A = *matrix* and b = *rhs* using the named *solver*.
+
+    If *precondition* is True, the columns of A are scaled to unit norm
+    before solving and the solution is scaled back afterwards. The
+    damping rows are scaled likewise and solved as part of the system,
+    so the same problem is solved with or without preconditioning.
+
+    If *comm* is given, *matrix* holds only this rank's rows of A and
+    the solve is distributed across all ranks of *comm*, which must
+    call this function collectively.
+
+    Returns a three-tuple of the solution, the number of iterations,
+    and the norm of the damped residual, sqrt(|b - Ax|^2 + damp^2 |x|^2).
+    """
+
+    if solver not in SOLVERS:
+        raise (ValueError(f"Unrecognized solver ({solver}) supplied."))
+
+    if precondition is True:
+        norms = column_norms(matrix, comm=comm)
+        scale = scipy.sparse.diags(1 / norms)
+        matrix = scipy.sparse.csr_matrix(matrix) @ scale
+        if damp > 0:
+            # Solve min |[AD; damp D] y - [b; 0]|^2 with x = Dy, which is
+            # the original damped problem. The last rank holds the
+            # damping rows, which follow all rows of A in *rhs*.
+            rhs = np.concatenate([rhs, np.zeros(len(norms), dtype=_constants.DTYPE_REAL)])
+            if comm is None or comm.Get_rank() == comm.Get_size() - 1:
+                matrix = scipy.sparse.vstack([matrix, damp * scale], format="csr")
+            damp = 0.
+
+    if comm is not None:
+        if solver == "dense":
+            raise (ValueError("Dense solves cannot be distributed."))
+        matrix = distributed_operator(matrix, comm=comm)
+
+    x, itn, normr = SOLVERS[solver](
+        matrix,
+        rhs,
+        damp,
+        atol,
+        btol,
+        conlim,
+        maxiter
+    )
+
+    if precondition is True:
+        x = x / norms
+
+    return (x, itn, normr)
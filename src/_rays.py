@@ -0,0 +1,119 @@
+"""
+A module defining a cache of raypaths traced through traveltime-lookup
+tables.
+
+.. date:: 2026-10-16
+"""
+
+import numpy as np
+
+import _constants
+
+
+class RayCache(object):
+    """
+    A class to store raypaths keyed by (event_id, network, station,
+    phase) so that each ray is traced at most once while velocity models
+    and event locations are fixed.
+
+    Raypaths are packed end-to-end into large chunks rather than stored
+    as individual arrays. At most *max_size* bytes of raypaths are
+    stored; rays traced after the cache is full are not stored.
+    """
+
+    def __init__(self, max_size=0, chunk_size=2**16):
+        self._chunk_size = chunk_size
+        self._max_size = max_size
+        self.clear()
+        self.reset_statistics()
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes allocated to store raypaths.
+        """
+        return (sum(chunk.nbytes for chunk in self._chunks))
+
+    @property
+    def statistics(self):
+        """
+        A two-tuple of the number of cache hits and misses since the
+        statistics were last reset.
+        """
+        return (self._hits, self._misses)
+
+    def _store(self, key, raypath):
+        """
+        Copy *raypath* into the cache under *key* if space allows.
+        """
+
+        npts = len(raypath)
+
+        if len(self._chunks) == 0 or self._fill + npts > len(self._chunks[-1]):
+            size = max(self._chunk_size, npts)
+            nbytes = size * 3 * np.dtype(_constants.DTYPE_REAL).itemsize
+            if self.nbytes + nbytes > self._max_size:
+                return (False)
+            self._chunks.append(np.empty((size, 3), dtype=_constants.DTYPE_REAL))
+            self._fill = 0
+
+        ichunk = len(self._chunks) - 1
+        self._chunks[ichunk][self._fill: self._fill+npts] = raypath
+        self._index[key] = (ichunk, self._fill, self._fill+npts)
+        self._fill += npts
+
+        return (True)
+
+    def clear(self):
+        """
+        Discard all cached raypaths.
+
+        Must be called whenever traveltime-lookup tables or event
+        locations change.
+        """
+
+        self._chunks = []
+        self._fill = 0
+        self._index = dict()
+
+        return (True)
+
+    def get(self, key):
+        """
+        Return the raypath stored under *key* or None if absent.
+        """
+
+        if key not in self._index:
+            return (None)
+
+        ichunk, start, stop = self._index[key]
+
+        return (self._chunks[ichunk][start: stop])
+
+    def reset_statistics(self):
+        """
+        Reset the cache hit and miss counts.
+        """
+
+        self._hits = 0
+        self._misses = 0
+
+        return (True)
+
+    def trace(self, traveltime, key, coords):
+        """
+        Return the raypath from *coords* through *traveltime*, tracing
+        it only if no raypath is stored under *key*.
+        """
+
+        raypath = self.get(key)
+
+        if raypath is not None:
+            self._hits += 1
+            return (raypath)
+
+        self._misses += 1
+        raypath = traveltime.trace_ray(coords)
+        self._store(key, raypath)
+
+        return (raypath)
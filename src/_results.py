@@ -0,0 +1,286 @@
+"""
+A module providing lazy access to inversion outputs.
+
+Outputs may be in either layout written by InversionIterator.save():
+separate files per iteration or a single HDF5 store. Arrays are memory
+mapped or sliced on disk, so only the requested data are read.
+
+.. date:: 2026-10-16
+"""
+
+import glob
+import numpy as np
+import os
+import pandas as pd
+import struct
+import tables
+import zipfile
+
+import _constants
+import _dataio
+
+PHASES = dict(P="pwave", S="swave")
+
+
+def _npz_array(path, key):
+    """
+    Return array *key* of the NPZ file at *path*, memory mapped if it
+    is stored uncompressed and loaded in full otherwise.
+    """
+
+    name = f"{key}.npy"
+
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return (np.load(path)[key])
+
+    with open(path, "rb") as file:
+        # Skip the local file header, whose extra field may differ from
+        # that of the central directory.
+        file.seek(info.header_offset)
+        header = file.read(30)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        file.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+
+    return (np.memmap(
+        path,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C"
+    ))
+
+
+class Results(object):
+    """
+    A class to read the outputs in *output_dir* lazily.
+
+    Array accessors accept an *idx* argument, which is applied on disk
+    (e.g., idx=(slice(None), 10) selects the tenth colatitude plane).
+    """
+
+    def __init__(self, output_dir):
+        self._handle = None
+        self._output_dir = output_dir
+        self._store_path = os.path.join(output_dir, _dataio.OUTPUT_FILENAME)
+
+    def __enter__(self):
+        return (self)
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def handle(self):
+        """
+        The open HDF5 store, or None if outputs are separate files.
+        """
+
+        if self._handle is None and os.path.isfile(self._store_path):
+            self._handle = tables.open_file(self._store_path, mode="r")
+
+        return (self._handle)
+
+    @property
+    def iterations(self):
+        """
+        A sorted list of the saved iteration numbers.
+        """
+
+        if self.handle is not None:
+            iterations = [
+                int(group._v_name[4:])
+                for group in self.handle.iter_nodes("/", classname="Group")
+                if group._v_name.startswith("iter")
+            ]
+        else:
+            paths = glob.glob(os.path.join(self._output_dir, "*.events.h5"))
+            iterations = [
+                int(os.path.basename(path).split(".")[0])
+                for path in paths
+            ]
+
+        return (sorted(iterations))
+
+    def _array(self, iiter, name, idx=Ellipsis):
+        """
+        Return *idx* of array *name* (e.g., "pwave_stack") of iteration
+        *iiter*.
+        """
+
+        if self.handle is not None:
+            return (self.handle.get_node(f"/iter{iiter:02d}", name)[idx])
+
+        path = self._path(iiter)
+        if name.endswith("_model"):
+            array = _npz_array(f"{path}.{name}.npz", "values")
+        else:
+            array = _npz_array(f"{path}.realizations.npz", name)
+
+        return (array[idx])
+
+    def _path(self, iiter):
+        """
+        Return the prefix of the output files of iteration *iiter*.
+        """
+
+        return (os.path.join(self._output_dir, f"{iiter:02d}"))
+
+    def _stack_extent(self, iiter, name):
+        """
+        Return the offset and number of the realizations in stack *name*
+        stored in the group of iteration *iiter*.
+        """
+
+        group = self.handle.get_node(f"/iter{iiter:02d}")
+        count = len(group._f_get_child(name)) if name in group else 0
+        attr = f"{name}_offset"
+        offset = int(group._v_attrs[attr]) if attr in group._v_attrs._f_list() else 0
+
+        return (offset, count)
+
+    def arrivals(self, iiter):
+        """
+        Return the arrivals of iteration *iiter* as a DataFrame.
+        """
+
+        if self.handle is None:
+            return (pd.read_hdf(f"{self._path(iiter)}.events.h5", key="arrivals"))
+
+        group = f"/iter{iiter:02d}"
+        if f"{group}/arrivals" in self.handle:
+            return (pd.read_hdf(self._store_path, key=f"{group}/arrivals"))
+
+        arrivals = pd.read_hdf(self._store_path, key="arrivals")
+        arrivals["residual"] = self.handle.get_node(group, "residuals")[:]
+
+        return (arrivals)
+
+    def close(self):
+        """
+        Close the HDF5 store, if open.
+        """
+
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+        return (True)
+
+    def depth_slice(self, iiter, depth, phase="P", kind="model", ireal=None):
+        """
+        Return the constant-depth slice nearest *depth* (in km) of the
+        *phase* model, variance, or realization *ireal* of iteration
+        *iiter*, depending on whether *kind* is "model", "variance", or
+        "realization".
+        """
+
+        grid = self.grid(iiter)
+        rho = _constants.EARTH_RADIUS - depth
+        irho = int(np.rint((rho - grid["min_coords"][0]) / grid["node_intervals"][0]))
+        if irho < 0 or irho >= grid["npts"][0]:
+            raise (ValueError(f"Depth {depth} km is outside the model grid."))
+
+        if kind == "model":
+            return (self.model(iiter, phase=phase, idx=irho))
+        elif kind == "variance":
+            return (self.variance(iiter, phase=phase, idx=irho))
+        elif kind == "realization":
+            return (self.realization(iiter, ireal, phase=phase, idx=irho))
+
+        raise (ValueError(f"Unrecognized kind ({kind}) supplied."))
+
+    def events(self, iiter):
+        """
+        Return the events of iteration *iiter* as a DataFrame.
+        """
+
+        if self.handle is None:
+            return (pd.read_hdf(f"{self._path(iiter)}.events.h5", key="events"))
+
+        return (pd.read_hdf(self._store_path, key=f"iter{iiter:02d}/events"))
+
+    def grid(self, iiter):
+        """
+        Return a dictionary of the "min_coords", "node_intervals", and
+        "npts" of the model grid of iteration *iiter*.
+        """
+
+        if self.handle is not None:
+            attrs = self.handle.get_node(f"/iter{iiter:02d}")._v_attrs
+            return ({key: np.asarray(attrs[key]) for key in _dataio.GRID_KEYS})
+
+        path = f"{self._path(iiter)}.realizations.npz"
+
+        return ({key: np.asarray(_npz_array(path, key)) for key in _dataio.GRID_KEYS})
+
+    def model(self, iiter, phase="P", idx=Ellipsis):
+        """
+        Return *idx* of the *phase* velocity model of iteration *iiter*.
+        """
+
+        return (self._array(iiter, f"{PHASES[phase]}_model", idx=idx))
+
+    def nrealizations(self, iiter, phase="P"):
+        """
+        Return the number of *phase* realizations saved for iteration
+        *iiter*.
+        """
+
+        if self.handle is not None:
+            offset, count = self._stack_extent(iiter, f"{PHASES[phase]}_stack")
+            return (offset + count)
+
+        path = f"{self._path(iiter)}.realizations.npz"
+        with zipfile.ZipFile(path) as archive:
+            if f"{PHASES[phase]}_stack.npy" not in archive.namelist():
+                return (0)
+
+        return (len(_npz_array(path, f"{PHASES[phase]}_stack")))
+
+    def realization(self, iiter, ireal, phase="P", idx=Ellipsis):
+        """
+        Return *idx* of the *ireal*-th *phase* realization of iteration
+        *iiter*.
+        """
+
+        name = f"{PHASES[phase]}_stack"
+
+        if self.handle is not None:
+            # Each group of the store holds only the realizations added
+            # since the previous group on the same grid.
+            if ireal < 0:
+                ireal += self.nrealizations(iiter, phase=phase)
+            for _iiter in reversed(self.iterations):
+                if _iiter > iiter:
+                    continue
+                offset, count = self._stack_extent(_iiter, name)
+                if offset <= ireal < offset + count:
+                    iiter, ireal = _iiter, ireal - offset
+                    break
+                if ireal >= offset + count or offset == 0:
+                    raise (IndexError(f"Realization {ireal} is out of range."))
+
+        if idx is Ellipsis:
+            idx = (ireal,)
+        elif isinstance(idx, tuple):
+            idx = (ireal, *idx)
+        else:
+            idx = (ireal, idx)
+
+        return (self._array(iiter, name, idx=idx))
+
+    def variance(self, iiter, phase="P", idx=Ellipsis):
+        """
+        Return *idx* of the *phase* variance of iteration *iiter*.
+        """
+
+        return (self._array(iiter, f"{PHASES[phase]}_variance", idx=idx))
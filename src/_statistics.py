@@ -0,0 +1,216 @@
+"""
+A module defining streaming statistics of velocity-model realizations.
+
+.. date:: 2026-10-16
+"""
+
+import numpy as np
+import os
+import tempfile
+
+import _constants
+
+STORAGES = ("memory", "memmap", "none")
+
+
+class RealizationStack(object):
+    """
+    A class to accumulate velocity-model realizations.
+
+    The running mean and variance are updated with Welford's algorithm
+    as realizations are appended, so neither requires the realizations
+    themselves. Full realizations are kept in memory if *storage* is
+    "memory", spilled to a temporary file in *spill_dir* and read back
+    as a memory map if *storage* is "memmap", and discarded if
+    *storage* is "none".
+    """
+
+    def __init__(self, storage="memory", spill_dir=None, dtype=_constants.DTYPE_REAL):
+        if storage not in STORAGES:
+            raise (ValueError(f"Unrecognized storage ({storage}) supplied."))
+        self._dtype = np.dtype(dtype)
+        self._file = None
+        self._spill_dir = spill_dir
+        self._storage = storage
+        self.clear()
+
+    def __len__(self):
+        return (self._count)
+
+    @property
+    def m2(self):
+        """
+        The sum of squared deviations from the mean.
+        """
+        return (self._m2)
+
+    @property
+    def mean(self):
+        """
+        The mean of the realizations. The array is updated in place as
+        realizations are added.
+        """
+        return (self._mean)
+
+    @property
+    def realizations(self):
+        """
+        An array of all realizations stacked along the first axis, or
+        None if realizations are not kept.
+        """
+
+        if self._storage == "none":
+            return (None)
+
+        if self._count == 0:
+            return (np.empty((0,), dtype=self._dtype))
+
+        if self._storage == "memory":
+            return (np.stack(self._realizations))
+
+        return (np.memmap(
+            self._file.name,
+            dtype=self._dtype,
+            mode="r",
+            shape=(self._count, *self._shape)
+        ))
+
+    @property
+    def shape(self):
+        return (self._shape)
+
+    @property
+    def storage(self):
+        return (self._storage)
+
+    @property
+    def variance(self):
+        """
+        The (population) variance of the realizations.
+        """
+        return (self._m2 / self._count)
+
+    def _store(self, values):
+        """
+        Keep a copy of *values* according to the storage mode.
+        """
+
+        if self._storage == "memory":
+            self._realizations.append(np.array(values, dtype=self._dtype))
+        elif self._storage == "memmap":
+            if self._file is None:
+                if self._spill_dir is not None:
+                    os.makedirs(self._spill_dir, exist_ok=True)
+                self._file = tempfile.NamedTemporaryFile(
+                    dir=self._spill_dir,
+                    prefix="realizations.",
+                    suffix=".bin"
+                )
+            self._file.write(np.ascontiguousarray(values, dtype=self._dtype).tobytes())
+            self._file.flush()
+
+        return (True)
+
+    def append(self, values):
+        """
+        Append the realization *values*.
+        """
+
+        values = np.asarray(values, dtype=self._dtype)
+
+        if self._count == 0:
+            self._shape = values.shape
+            self._mean = np.zeros(self._shape, dtype=self._dtype)
+            self._m2 = np.zeros(self._shape, dtype=self._dtype)
+        elif values.shape != self._shape:
+            raise (ValueError(
+                f"Realization shape {values.shape} does not match {self._shape}."
+            ))
+
+        self._count += 1
+        delta = values - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (values - self._mean)
+        self._store(values)
+
+        return (True)
+
+    def clear(self):
+        """
+        Discard all realizations and statistics.
+        """
+
+        if self._file is not None:
+            self._file.close()
+
+        self._count = 0
+        self._file = None
+        self._m2 = None
+        self._mean = None
+        self._realizations = []
+        self._shape = None
+
+        return (True)
+
+    def merge(self, count, mean, m2, realizations=None):
+        """
+        Merge the statistics of *count* realizations with the given
+        *mean* and sum of squared deviations *m2*, and keep
+        *realizations* if given.
+        """
+
+        if count == 0:
+            return (True)
+
+        mean = np.asarray(mean, dtype=self._dtype)
+        m2 = np.asarray(m2, dtype=self._dtype)
+
+        if self._count == 0:
+            self._shape = mean.shape
+            self._mean = mean.copy()
+            self._m2 = m2.copy()
+            self._count = count
+        else:
+            # Chan et al.'s pairwise update.
+            total = self._count + count
+            delta = mean - self._mean
+            self._mean += delta * (count / total)
+            self._m2 += m2 + delta**2 * (self._count * count / total)
+            self._count = total
+
+        if realizations is not None:
+            for values in realizations:
+                self._store(values)
+
+        return (True)
+
+    def transform(self, func):
+        """
+        Replace every realization with func(realization), e.g. to
+        resample realizations onto a new grid.
+
+        Statistics are recomputed exactly if realizations are kept.
+        Otherwise *func* is applied to the mean and to the sum of
+        squared deviations, which only approximates the variance.
+        """
+
+        if self._count == 0:
+            return (True)
+
+        if self._storage == "none":
+            self._mean = np.asarray(func(self._mean), dtype=self._dtype)
+            self._m2 = np.maximum(func(self._m2), 0).astype(self._dtype)
+            self._shape = self._mean.shape
+            return (True)
+
+        # Keep the spill file open until its realizations are read.
+        realizations, _file = self.realizations, self._file
+        self._file = None
+        self.clear()
+        for values in realizations:
+            self.append(func(values))
+        del (realizations)
+        if _file is not None:
+            _file.close()
+
+        return (True)
@@ -0,0 +1,702 @@
+"""
+A module defining functions to manage traveltime-lookup tables on disk.
+
+.. date:: 2026-10-16
+"""
+
+import collections
+import hashlib
+import json
+import mpi4py.MPI as MPI
+import numpy as np
+import os
+import pykonal
+
+import _picklable
+
+MANIFEST_FILENAME = "manifest.json"
+PRECISIONS = ("float64", "float32", "float16")
+
+# State shared by solve_table() calls within a process; set by
+# initialize_solver().
+_SOLVER_STATE = dict()
+
+
+def table_name(network, station, phase):
+    """
+    Return the file name of the traveltime-lookup table for the given
+    network, station, and phase.
+    """
+
+    return (f"{network}.{station}.{phase}.npz")
+
+
+def model_digest(model):
+    """
+    Return a hexadecimal digest of the values and grid geometry of
+    *model*.
+    """
+
+    sha = hashlib.sha1()
+    sha.update(model.coord_sys.encode())
+    sha.update(np.asarray(model.min_coords, dtype=np.float64).tobytes())
+    sha.update(np.asarray(model.node_intervals, dtype=np.float64).tobytes())
+    sha.update(np.asarray(model.npts, dtype=np.int64).tobytes())
+    sha.update(np.ascontiguousarray(model.values, dtype=np.float64).tobytes())
+
+    return (sha.hexdigest())
+
+
+def table_digest(model_digest, coords, encoding="", bounds=None):
+    """
+    Return a hexadecimal digest identifying the traveltime-lookup table
+    computed in the model identified by *model_digest* for a source at
+    *coords* over the sub-domain *bounds* and stored with *encoding*.
+    """
+
+    sha = hashlib.sha1(model_digest.encode())
+    sha.update(np.asarray(coords, dtype=np.float64).tobytes())
+    sha.update(encoding.encode())
+    if bounds is not None:
+        sha.update(np.asarray(bounds, dtype=np.int64).tobytes())
+
+    return (sha.hexdigest())
+
+
+def load_manifest(traveltime_dir):
+    """
+    Return the manifest of traveltime-lookup tables in *traveltime_dir*.
+
+    The manifest is a dictionary mapping table file names to the digest
+    of the model and source location used to compute them. An empty
+    dictionary is returned if no manifest exists.
+    """
+
+    path = os.path.join(traveltime_dir, MANIFEST_FILENAME)
+
+    if not os.path.isfile(path):
+        return (dict())
+
+    with open(path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    return (manifest)
+
+
+def save_manifest(traveltime_dir, manifest):
+    """
+    Write *manifest* to *traveltime_dir*.
+
+    The manifest is written to a temporary file first and then moved
+    into place so that an interrupted job never leaves a partially
+    written manifest behind.
+    """
+
+    path = os.path.join(traveltime_dir, MANIFEST_FILENAME)
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=0, sort_keys=True)
+    os.replace(tmp_path, path)
+
+    return (True)
+
+
+def domain_bounds(model, coords, margin=0):
+    """
+    Return the index bounds of the smallest sub-domain of *model*'s grid
+    that contains all points in *coords*, padded by *margin* nodes.
+
+    Bounds are returned as a two-tuple of (lower, upper) index tuples,
+    where upper indices are exclusive, and are clipped to the grid.
+    Raises ValueError if any coordinate is not finite.
+    """
+
+    coords = np.reshape(coords, (-1, 3))
+    if not np.all(np.isfinite(coords)):
+        raise (ValueError("Sub-domain coordinates must be finite."))
+    idxs = (coords - model.min_coords) / model.node_intervals
+    npts = np.asarray(model.npts)
+
+    imin = np.floor(np.min(idxs, axis=0)).astype(np.int64) - margin
+    imax = np.ceil(np.max(idxs, axis=0)).astype(np.int64) + margin + 1
+    imin = np.clip(imin, 0, npts - 1)
+    imax = np.clip(imax, imin + 1, npts)
+
+    return (tuple(imin.tolist()), tuple(imax.tolist()))
+
+
+def expand(field, grid, fill_value):
+    """
+    Return *field*, which may cover a sub-domain of *grid*, embedded in
+    a field covering all of *grid*. Nodes outside *field* are set to
+    *fill_value*.
+    """
+
+    if np.all(np.asarray(field.npts) == np.asarray(grid.npts)):
+        return (field)
+
+    offset = (np.asarray(field.min_coords) - grid.min_coords) / grid.node_intervals
+    imin = np.round(offset).astype(np.int64)
+    imax = imin + np.asarray(field.npts)
+
+    values = np.full(grid.npts, fill_value, dtype=np.float64)
+    values[imin[0]:imax[0], imin[1]:imax[1], imin[2]:imax[2]] = field.values
+
+    _field = _picklable.ScalarField3D(coord_sys=field.coord_sys)
+    _field.min_coords = grid.min_coords
+    _field.node_intervals = grid.node_intervals
+    _field.npts = grid.npts
+    _field.values = values
+
+    return (_field)
+
+
+def covers(field, coords, grid=None):
+    """
+    Return True if every point in *coords* lies within the grid of
+    *field*, which may cover a sub-domain of *grid*. Points are first
+    clipped to *grid*, if given.
+    """
+
+    coords = np.reshape(coords, (-1, 3))
+    if grid is not None:
+        coords = np.clip(coords, grid.min_coords, grid.max_coords)
+
+    # Allow for rounding error at the edges of the grid.
+    tolerance = 1e-6 * np.asarray(field.node_intervals)
+    inside = np.all(
+         (coords >= np.asarray(field.min_coords) - tolerance)
+        &(coords <= np.asarray(field.max_coords) + tolerance)
+    )
+
+    return (bool(inside))
+
+
+def initialize_solver(store, models):
+    """
+    Initialize the state used by solve_table() in the calling process.
+
+    *store* is the TraveltimeStore to which tables are saved and
+    *models* is a dictionary mapping phase names to velocity models.
+    This function is suitable as the initializer of a thread or process
+    pool.
+    """
+
+    _SOLVER_STATE["store"] = store
+    _SOLVER_STATE["models"] = models
+
+    return (True)
+
+
+def solve_table(network, station, phase, coords, bounds=None):
+    """
+    Compute and save the *phase* traveltime-lookup table for a source
+    at spherical *coords*.
+
+    If *bounds* (see domain_bounds()) is given, the table only covers
+    that sub-domain of the model grid.
+
+    Returns the storage error reported by TraveltimeStore.save().
+    """
+
+    model = _SOLVER_STATE["models"][phase]
+
+    min_coords = np.asarray(model.min_coords)
+    values = model.values
+    if bounds is not None:
+        imin, imax = bounds
+        min_coords = min_coords + np.asarray(imin) * model.node_intervals
+        values = values[imin[0]:imax[0], imin[1]:imax[1], imin[2]:imax[2]]
+
+    solver = pykonal.solver.PointSourceSolver(coord_sys="spherical")
+    solver.vv.min_coords = min_coords
+    solver.vv.node_intervals = model.node_intervals
+    solver.vv.npts = values.shape
+    solver.vv.values = np.ascontiguousarray(values)
+    solver.src_loc = coords
+    solver.solve()
+
+    store = _SOLVER_STATE["store"]
+    error = store.save(network, station, phase, solver.tt)
+
+    return (error)
+
+
+def _write_row(path, irow, values):
+    """
+    Write *values* as row *irow* of the NPY file at *path*.
+
+    Only the bytes of the row are written, so that ranks writing
+    different rows concurrently, possibly from different nodes of a
+    filesystem without coherent memory maps, do not overwrite each
+    other's pages.
+    """
+
+    with open(path, "rb") as file:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        header_nbytes = file.tell()
+
+    data = np.ascontiguousarray(values, dtype=dtype).tobytes()
+    row_nbytes = int(np.prod(shape[1:])) * dtype.itemsize
+    if len(data) != row_nbytes:
+        raise (ValueError(f"Row of {len(data)} bytes does not fit {path}."))
+
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, header_nbytes + irow * row_nbytes)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    return (True)
+
+
+class TraveltimeStore(object):
+    """
+    A class providing uniform access to traveltime-lookup tables.
+
+    Tables are stored either as one NPZ file per network, station, and
+    phase ("npz") or as a single uncompressed NPY file per phase that
+    is memory mapped and sliced by station ("memmap"). The latter avoids
+    opening thousands of small files on shared filesystems.
+
+    Values may be stored with reduced *precision*: "float32", or
+    "float16" offsets from a per-table reference value. NPZ files may
+    additionally be compressed. Tables are always returned as float64.
+
+    Loaded tables are kept in a least-recently-used cache of at most
+    *cache_size* bytes, which is emptied whenever the store is closed.
+    Alternatively, a set of tables can be shared by all ranks on a node
+    through an MPI-3 shared-memory window (see share()).
+    """
+
+    def __init__(
+        self,
+        traveltime_dir,
+        fmt="npz",
+        precision="float64",
+        compress=False,
+        cache_size=0
+    ):
+        if fmt not in ("npz", "memmap"):
+            raise (ValueError(f"Unrecognized traveltime store format ({fmt})."))
+        if precision not in PRECISIONS:
+            raise (ValueError(f"Unrecognized traveltime precision ({precision})."))
+        if fmt == "memmap" and compress is True:
+            raise (ValueError("Memory-mapped traveltime stores cannot be compressed."))
+        self._traveltime_dir = traveltime_dir
+        self._fmt = fmt
+        self._precision = precision
+        self._compress = compress
+        self._indexes = dict()
+        self._arrays = dict()
+        self._offsets = dict()
+        self._cache = collections.OrderedDict()
+        self._cache_nbytes = 0
+        self._cache_size = cache_size
+        self._hits = 0
+        self._misses = 0
+        self._shared = dict()
+        self._shared_array = None
+        self._shared_grid = None
+        self._shared_offsets = None
+        self._window = None
+        self._node_comm = None
+
+    @property
+    def statistics(self):
+        """
+        A two-tuple of the number of cache hits and misses since the
+        statistics were last reset.
+        """
+        return (self._hits, self._misses)
+
+    @property
+    def compress(self):
+        return (self._compress)
+
+    @property
+    def encoding(self):
+        """
+        A string identifying how tables are encoded on disk.
+        """
+        return (f"{self.fmt}:{self.precision}:{self.compress}")
+
+    @property
+    def fmt(self):
+        return (self._fmt)
+
+    @property
+    def precision(self):
+        return (self._precision)
+
+    @property
+    def traveltime_dir(self):
+        return (self._traveltime_dir)
+
+    def _array_path(self, phase):
+        return (os.path.join(self.traveltime_dir, f"traveltimes.{phase}.npy"))
+
+    def _index_path(self, phase):
+        return (os.path.join(self.traveltime_dir, f"traveltimes.{phase}.json"))
+
+    def _offsets_path(self, phase):
+        return (os.path.join(self.traveltime_dir, f"traveltimes.{phase}.offsets.npy"))
+
+    def _index(self, phase):
+        """
+        Return the station index and grid geometry for *phase*.
+        """
+
+        if phase not in self._indexes:
+            with open(self._index_path(phase), "r") as index_file:
+                index = json.load(index_file)
+            index["rows"] = {
+                station_id: irow
+                for irow, station_id in enumerate(index["stations"])
+            }
+            self._indexes[phase] = index
+
+        return (self._indexes[phase])
+
+    def _array(self, phase):
+        """
+        Return the memory-mapped array of tables for *phase*.
+
+        The array is opened copy-on-write so that slices are writable
+        without ever touching the file or copying unmodified pages.
+        """
+
+        if phase not in self._arrays:
+            self._arrays[phase] = np.load(self._array_path(phase), mmap_mode="c")
+            self._offsets[phase] = np.load(self._offsets_path(phase))
+
+        return (self._arrays[phase])
+
+    def _decode(self, values, offset):
+        """
+        Return *values* up-cast to float64 with *offset* added.
+
+        Float64 values are returned without copying.
+        """
+
+        if values.dtype == np.float64 and offset == 0:
+            return (values)
+
+        return (values.astype(np.float64) + offset)
+
+    def _encode(self, values):
+        """
+        Return *values* encoded with the configured precision and the
+        reference offset subtracted from them.
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+
+        if self.precision == "float16":
+            offset = 0.5 * (np.min(values) + np.max(values))
+        else:
+            offset = 0.
+
+        return ((values - offset).astype(self.precision), offset)
+
+    def close(self):
+        """
+        Release all open memory maps and cached indexes.
+
+        Must be called by every rank before tables are recomputed.
+        """
+
+        self._indexes = dict()
+        self._arrays = dict()
+        self._offsets = dict()
+        self._cache = collections.OrderedDict()
+        self._cache_nbytes = 0
+
+        return (True)
+
+    def exists(self, network, station, phase):
+        """
+        Return True if the table for *network*, *station*, and *phase*
+        is present in the store.
+        """
+
+        if self.fmt == "npz":
+            filename = table_name(network, station, phase)
+            return (os.path.isfile(os.path.join(self.traveltime_dir, filename)))
+
+        if not os.path.isfile(self._index_path(phase)):
+            return (False)
+
+        return (f"{network}.{station}" in self._index(phase)["rows"])
+
+    def initialize(self, phase, station_ids, model):
+        """
+        Prepare the store to receive *phase* tables for *station_ids*
+        computed on the grid of *model*.
+
+        Returns True if tables already in the store remain valid and
+        False if they were discarded. Only the root rank should call
+        this method.
+        """
+
+        if self.fmt == "npz":
+            return (True)
+
+        index = dict(
+            stations=[f"{network}.{station}" for network, station in station_ids],
+            precision=self.precision,
+            coord_sys=model.coord_sys,
+            min_coords=np.asarray(model.min_coords, dtype=np.float64).tolist(),
+            node_intervals=np.asarray(model.node_intervals, dtype=np.float64).tolist(),
+            npts=np.asarray(model.npts, dtype=np.int64).tolist()
+        )
+
+        if os.path.isfile(self._index_path(phase)):
+            with open(self._index_path(phase), "r") as index_file:
+                if json.load(index_file) == index:
+                    return (True)
+
+        # Write new files and move them into place so that processes
+        # holding maps of the old files are not affected.
+        path = self._array_path(phase)
+        shape = (len(station_ids), *index["npts"])
+        array = np.lib.format.open_memmap(
+            f"{path}.tmp",
+            mode="w+",
+            dtype=self.precision,
+            shape=shape
+        )
+        del (array)
+        os.replace(f"{path}.tmp", path)
+
+        path = self._offsets_path(phase)
+        array = np.lib.format.open_memmap(
+            f"{path}.tmp",
+            mode="w+",
+            dtype=np.float64,
+            shape=(len(station_ids),)
+        )
+        del (array)
+        os.replace(f"{path}.tmp", path)
+
+        path = self._index_path(phase)
+        with open(f"{path}.tmp", "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(f"{path}.tmp", path)
+
+        self.close()
+
+        return (False)
+
+    def _load(self, network, station, phase):
+        """
+        Read and return the table for *network*, *station*, and *phase*
+        from disk.
+        """
+
+        field, values, offset = self._read(network, station, phase)
+        field.values = self._decode(values, offset)
+
+        return (field)
+
+    def _read(self, network, station, phase):
+        """
+        Read the table for *network*, *station*, and *phase* from disk
+        without decoding it.
+
+        Returns a three-tuple of a field with the grid geometry of the
+        table but no values, the stored values, and their offset.
+        """
+
+        if self.fmt == "npz":
+            filename = table_name(network, station, phase)
+            path = os.path.join(self.traveltime_dir, filename)
+            with np.load(path) as npz:
+                coord_sys = str(np.squeeze(npz["coord_sys"]))
+                min_coords = npz["min_coords"]
+                node_intervals = npz["node_intervals"]
+                npts = npz["npts"]
+                offset = float(npz["offset"]) if "offset" in npz.files else 0.
+                values = npz["values"]
+        else:
+            index = self._index(phase)
+            irow = index["rows"][f"{network}.{station}"]
+            coord_sys = index["coord_sys"]
+            min_coords = index["min_coords"]
+            node_intervals = index["node_intervals"]
+            npts = index["npts"]
+            values = self._array(phase)[irow]
+            offset = self._offsets[phase][irow]
+
+        field = _picklable.ScalarField3D(coord_sys=coord_sys)
+        field.min_coords = min_coords
+        field.node_intervals = node_intervals
+        field.npts = npts
+
+        return (field, values, offset)
+
+    def load(self, network, station, phase):
+        """
+        Return the table for *network*, *station*, and *phase* as a
+        _picklable.ScalarField3D object with float64 values.
+        """
+
+        key = (network, station, phase)
+
+        if key in self._shared:
+            field = _picklable.ScalarField3D(coord_sys=self._shared_grid.coord_sys)
+            field.min_coords = self._shared_grid.min_coords
+            field.node_intervals = self._shared_grid.node_intervals
+            field.npts = self._shared_grid.npts
+            irow = self._shared[key]
+            field.values = self._decode(
+                self._shared_array[irow],
+                self._shared_offsets[irow]
+            )
+            return (field)
+
+        if key in self._cache:
+            self._hits += 1
+            self._cache.move_to_end(key)
+            return (self._cache[key])
+
+        self._misses += 1
+        field = self._load(network, station, phase)
+        nbytes = np.asarray(field.values).nbytes
+
+        if nbytes <= self._cache_size:
+            self._cache[key] = field
+            self._cache_nbytes += nbytes
+            while self._cache_nbytes > self._cache_size:
+                _, _field = self._cache.popitem(last=False)
+                self._cache_nbytes -= np.asarray(_field.values).nbytes
+
+        return (field)
+
+    def reset_statistics(self):
+        """
+        Reset the cache hit and miss counts.
+        """
+
+        self._hits = 0
+        self._misses = 0
+
+        return (True)
+
+    def share(self, keys, grid, comm):
+        """
+        Load the tables identified by the (network, station, phase)
+        tuples in *keys* into one MPI-3 shared-memory window per node of
+        *comm*. Tables are kept in the window with the stored precision
+        and decoded by load(), which returns views into the window
+        without copying if the precision is float64.
+
+        Every table must cover the full *grid*. Each table is read from
+        disk by only one rank per node. This method is collective over
+        *comm* and all ranks must pass identical *keys*.
+        """
+
+        self.unshare()
+
+        self._node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+        node_rank = self._node_comm.Get_rank()
+        node_size = self._node_comm.Get_size()
+
+        npts = tuple(np.asarray(grid.npts).tolist())
+        dtype = np.dtype(self.precision)
+        itemsize = dtype.itemsize
+        nbytes = len(keys) * int(np.prod(npts)) * itemsize
+
+        self._window = MPI.Win.Allocate_shared(
+            nbytes if node_rank == 0 else 0,
+            itemsize,
+            comm=self._node_comm
+        )
+        buffer, _ = self._window.Shared_query(0)
+        self._shared_array = np.ndarray(
+            buffer=buffer,
+            dtype=dtype,
+            shape=(len(keys), *npts)
+        )
+
+        # Offsets are few, so every rank keeps its own copy.
+        offsets = np.zeros(len(keys), dtype=np.float64)
+        for irow, key in enumerate(keys):
+            if irow % node_size == node_rank:
+                _, values, offset = self._read(*key)
+                self._shared_array[irow] = values
+                offsets[irow] = offset
+        self._shared_offsets = np.empty_like(offsets)
+        self._node_comm.Allreduce(offsets, self._shared_offsets, op=MPI.SUM)
+        self._node_comm.Barrier()
+
+        self._shared = {tuple(key): irow for irow, key in enumerate(keys)}
+        self._shared_grid = grid
+
+        return (True)
+
+    def unshare(self):
+        """
+        Release the shared-memory window created by share().
+
+        This method is collective over the communicator passed to
+        share() and does nothing if no tables are shared.
+        """
+
+        if self._window is None:
+            return (False)
+
+        self._shared = dict()
+        self._shared_array = None
+        self._shared_grid = None
+        self._shared_offsets = None
+        self._window.Free()
+        self._window = None
+        self._node_comm.Free()
+        self._node_comm = None
+
+        return (True)
+
+    def save(self, network, station, phase, field):
+        """
+        Write *field* as the table for *network*, *station*, and
+        *phase*.
+
+        Returns the maximum absolute difference between the stored
+        values and the float64 values of *field*.
+        """
+
+        key = (network, station, phase)
+        if key in self._cache:
+            _field = self._cache.pop(key)
+            self._cache_nbytes -= np.asarray(_field.values).nbytes
+
+        values, offset = self._encode(field.values)
+        error = np.max(np.abs(self._decode(values, offset) - field.values))
+
+        if self.fmt == "npz":
+            filename = table_name(network, station, phase)
+            savez = np.savez_compressed if self.compress is True else np.savez
+            savez(
+                os.path.join(self.traveltime_dir, filename),
+                coord_sys=[field.coord_sys],
+                field_type=["scalar"],
+                min_coords=field.min_coords,
+                node_intervals=field.node_intervals,
+                npts=field.npts,
+                values=values,
+                offset=offset
+            )
+            return (error)
+
+        irow = self._index(phase)["rows"][f"{network}.{station}"]
+        _write_row(self._array_path(phase), irow, values)
+        _write_row(self._offsets_path(phase), irow, offset)
+
+        return (error)
@@ -10,6 +10,7 @@ import argparse
 import configparser
 import logging
 import mpi4py.MPI as MPI
+import numpy as np
 import signal
 
 import _constants
@@ -18,6 +19,59 @@ COMM = MPI.COMM_WORLD
 RANK = COMM.Get_rank()
 
 
+class ArrayBuffer(object):
+    """
+    A class to accumulate a one-dimensional array from many small
+    appends.
+
+    Values are written into preallocated chunks, avoiding the quadratic
+    copying of repeated numpy.append() calls.
+    """
+
+    def __init__(self, dtype, chunk_size=2**16):
+        self._chunk_size = chunk_size
+        self._chunks = []
+        self._dtype = dtype
+        self._fill = 0
+
+    def __len__(self):
+        if len(self._chunks) == 0:
+            return (0)
+        return (sum(map(len, self._chunks[:-1])) + self._fill)
+
+    def append(self, values):
+        """
+        Append a scalar or array of *values*.
+        """
+
+        values = np.ravel(values)
+        nvalues = len(values)
+
+        if len(self._chunks) == 0 or self._fill + nvalues > len(self._chunks[-1]):
+            if len(self._chunks) > 0:
+                self._chunks[-1] = self._chunks[-1][:self._fill]
+            size = max(self._chunk_size, nvalues)
+            self._chunks.append(np.empty(size, dtype=self._dtype))
+            self._fill = 0
+
+        self._chunks[-1][self._fill: self._fill+nvalues] = values
+        self._fill += nvalues
+
+        return (True)
+
+    def array(self):
+        """
+        Return the accumulated values as a contiguous array.
+        """
+
+        if len(self._chunks) == 0:
+            return (np.empty(0, dtype=self._dtype))
+
+        chunks = self._chunks[:-1] + [self._chunks[-1][:self._fill]]
+
+        return (np.concatenate(chunks))
+
+
 def configure_logger(name, logfile, verbose=False):
     """
     A utility function to configure logging. Return True on successful
@@ -161,6 +215,38 @@ def parse_cfg(configuration_file):
         "algorithm",
         "narrival"
     )
+    _cfg["traveltime_domain"] = parser.get(
+        "algorithm",
+        "traveltime_domain",
+        fallback="full"
+    )
+    _cfg["traveltime_domain_margin"] = parser.getint(
+        "algorithm",
+        "traveltime_domain_margin",
+        fallback=2
+    )
+    _cfg["max_event_distance"] = parser.getfloat(
+        "algorithm",
+        "max_event_distance",
+        fallback=np.inf
+    )
+    _cfg["decimation_schedule"] = [
+        int(factor) for factor in parser.get(
+            "algorithm",
+            "decimation_schedule",
+            fallback="1"
+        ).split(",")
+    ]
+    _cfg["ray_projection"] = parser.get(
+        "algorithm",
+        "ray_projection",
+        fallback="kdtree"
+    )
+    _cfg["realization_batch_size"] = parser.getint(
+        "algorithm",
+        "realization_batch_size",
+        fallback=1
+    )
     _cfg["outlier_removal_factor"] = parser.getfloat(
         "algorithm",
         "outlier_removal_factor"
@@ -185,6 +271,21 @@ def parse_cfg(configuration_file):
         "algorithm",
         "maxiter"
     )
+    _cfg["solver"] = parser.get(
+        "algorithm",
+        "solver",
+        fallback="lsmr"
+    )
+    _cfg["precondition"] = parser.getboolean(
+        "algorithm",
+        "precondition",
+        fallback=False
+    )
+    _cfg["dense_threshold"] = parser.getint(
+        "algorithm",
+        "dense_threshold",
+        fallback=0
+    )
     cfg["algorithm"] = _cfg
 
     _cfg = dict()
@@ -207,6 +308,61 @@ def parse_cfg(configuration_file):
         "workspace",
         "traveltime_dir"
     )
+    _cfg["async_save"] = parser.getboolean(
+        "workspace",
+        "async_save",
+        fallback=False
+    )
+    _cfg["save_queue_size"] = parser.getint(
+        "workspace",
+        "save_queue_size",
+        fallback=1
+    )
+    _cfg["output_format"] = parser.get(
+        "workspace",
+        "output_format",
+        fallback="files"
+    )
+    _cfg["output_compression"] = parser.getint(
+        "workspace",
+        "output_compression",
+        fallback=4
+    )
+    _cfg["realization_storage"] = parser.get(
+        "workspace",
+        "realization_storage",
+        fallback="memory"
+    )
+    _cfg["traveltime_store"] = parser.get(
+        "workspace",
+        "traveltime_store",
+        fallback="npz"
+    )
+    _cfg["traveltime_precision"] = parser.get(
+        "workspace",
+        "traveltime_precision",
+        fallback="float64"
+    )
+    _cfg["compress_traveltimes"] = parser.getboolean(
+        "workspace",
+        "compress_traveltimes",
+        fallback=False
+    )
+    _cfg["traveltime_cache_size"] = parser.getfloat(
+        "workspace",
+        "traveltime_cache_size",
+        fallback=0
+    )
+    _cfg["ray_cache_size"] = parser.getfloat(
+        "workspace",
+        "ray_cache_size",
+        fallback=0
+    )
+    _cfg["reuse_traveltimes"] = parser.getboolean(
+        "workspace",
+        "reuse_traveltimes",
+        fallback=True
+    )
     cfg["workspace"] = _cfg
 
     _cfg = dict()
@@ -228,6 +384,39 @@ def parse_cfg(configuration_file):
     )
     cfg["locate"] = _cfg
 
+    _cfg = dict()
+    _cfg["dispatch_affinity"] = parser.getboolean(
+        "parallel",
+        "dispatch_affinity",
+        fallback=False
+    )
+    _cfg["distributed_solve"] = parser.getboolean(
+        "parallel",
+        "distributed_solve",
+        fallback=False
+    )
+    _cfg["ngroups"] = parser.getint(
+        "parallel",
+        "ngroups",
+        fallback=1
+    )
+    _cfg["nthreads"] = parser.getint(
+        "parallel",
+        "nthreads",
+        fallback=1
+    )
+    _cfg["pool"] = parser.get(
+        "parallel",
+        "pool",
+        fallback="thread"
+    )
+    _cfg["shared_traveltimes"] = parser.getboolean(
+        "parallel",
+        "shared_traveltimes",
+        fallback=False
+    )
+    cfg["parallel"] = _cfg
+
     return (cfg)
 
 
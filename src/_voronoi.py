@@ -0,0 +1,97 @@
+"""
+A module defining a spatial index of Voronoi cells.
+
+.. date:: 2026-10-16
+"""
+
+import numpy as np
+import pykonal
+import scipy.spatial
+
+sph2xyz = pykonal.transformations.sph2xyz
+
+
+class VoronoiIndex(object):
+    """
+    A class to assign points to Voronoi cells.
+
+    The KD-tree of cell centers is built once, when the object is
+    instantiated, and queried with up to *workers* threads.
+    """
+
+    def __init__(self, cells, workers=1):
+        self._ncells = len(cells)
+        self._tree = scipy.spatial.cKDTree(sph2xyz(cells, (0, 0, 0)))
+        self._workers = workers
+
+    @property
+    def ncells(self):
+        return (self._ncells)
+
+    def query(self, coords):
+        """
+        Return the index of the cell containing each point in spherical
+        *coords*.
+        """
+
+        coords = np.reshape(coords, (-1, 3))
+        _, idxs = self._tree.query(
+            sph2xyz(coords, (0, 0, 0)),
+            workers=self._workers
+        )
+
+        return (idxs)
+
+    def project(self, raypaths):
+        """
+        Return the cell IDs traversed by each raypath in *raypaths* and
+        the number of raypath points within each of those cells.
+
+        All raypaths are queried in a single batch. A list with one
+        (cell_ids, counts) tuple per raypath is returned.
+        """
+
+        if len(raypaths) == 0:
+            return ([])
+
+        lengths = [len(raypath) for raypath in raypaths]
+        idxs = self.query(np.concatenate(raypaths))
+        irays = np.repeat(np.arange(len(raypaths)), lengths)
+
+        # Count points per unique (ray, cell) pair.
+        keys = irays * self.ncells + idxs
+        keys, counts = np.unique(keys, return_counts=True)
+        irays, idxs = np.divmod(keys, self.ncells)
+        splits = np.searchsorted(irays, np.arange(1, len(raypaths)))
+
+        return (list(zip(np.split(idxs, splits), np.split(counts, splits))))
+
+
+class LabelIndex(VoronoiIndex):
+    """
+    A class to assign points to Voronoi cells using the cell *labels* of
+    the nodes of a regular grid.
+
+    Each point takes the label of the grid node nearest it in index
+    space, which is located arithmetically. This is O(1) per point, but
+    assignments are only as precise as the grid.
+    """
+
+    def __init__(self, labels, ncells, min_coords, node_intervals):
+        self._labels = labels
+        self._max_idxs = np.array(labels.shape) - 1
+        self._min_coords = np.asarray(min_coords)
+        self._ncells = ncells
+        self._node_intervals = np.asarray(node_intervals)
+
+    def query(self, coords):
+        """
+        Return the index of the cell containing each point in spherical
+        *coords*.
+        """
+
+        coords = np.reshape(coords, (-1, 3))
+        idxs = np.rint((coords - self._min_coords) / self._node_intervals)
+        idxs = np.clip(idxs.astype(np.intp), 0, self._max_idxs)
+
+        return (self._labels[idxs[:, 0], idxs[:, 1], idxs[:, 2]])
@@ -71,6 +71,9 @@ def main(argc):
     for iiter in range(niter):
         inversion_iterator.iterate()
 
+    # Wait for outputs to be written.
+    inversion_iterator.finalize()
+
     logger.debug("Thread completed without error.")
     return (True)
 
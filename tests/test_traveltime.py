@@ -0,0 +1,43 @@
+"""
+Tests for the pure functions of the _traveltime module.
+"""
+
+import numpy as np
+import os
+import pytest
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+pytest.importorskip("mpi4py")
+pytest.importorskip("pykonal")
+
+import _traveltime
+
+
+@pytest.fixture
+def grid():
+    return (types.SimpleNamespace(
+        min_coords=np.array([6000., 0.5, 0.]),
+        node_intervals=np.array([1., 0.01, 0.01]),
+        npts=np.array([100, 50, 50])
+    ))
+
+
+def test_domain_bounds(grid):
+    coords = [[6010.5, 0.605, 0.105], [6020.5, 0.705, 0.205]]
+    bounds = _traveltime.domain_bounds(grid, coords)
+    assert bounds == ((10, 10, 10), (22, 22, 22))
+
+
+def test_domain_bounds_margin_is_clipped(grid):
+    coords = [[6000., 0.5, 0.], [6099., 0.99, 0.49]]
+    bounds = _traveltime.domain_bounds(grid, coords, margin=2)
+    assert bounds == ((0, 0, 0), (100, 50, 50))
+
+
+def test_domain_bounds_rejects_non_finite_coords(grid):
+    coords = [[6000., 0.5 - np.inf, 0.], [6099., 0.5 + np.inf, 0.49]]
+    with pytest.raises(ValueError):
+        _traveltime.domain_bounds(grid, coords)